@@ -7,9 +7,15 @@ of entities and react to changes.
 """
 
 import time
+import uuid
 import logging
 import threading
 import enum
+import heapq
+import types
+import collections
+import collections.abc
+import itertools
 import datetime as dt
 import functools as ft
 
@@ -29,6 +35,7 @@ EVENT_CALL_SERVICE = "call_service"
 ATTR_NOW = "now"
 ATTR_DOMAIN = "domain"
 ATTR_SERVICE = "service"
+ATTR_ENTITY_ID = "entity_id"
 
 # How often time_changed event should fire
 TIMER_INTERVAL = 10  # seconds
@@ -36,16 +43,35 @@ TIMER_INTERVAL = 10  # seconds
 # Number of worker threads
 POOL_NUM_THREAD = 4
 
+# Maximum number of worker threads the pool may grow to under load
+POOL_MAX_THREAD = 16
+
+# Number of state changes kept to answer StateMachine.changes_since
+CHANGE_LOG_SIZE = 1000
+
+# Logger that receives a sample of the events, state changes, service calls
+# and jobs that go through the core. See enable_trace.
+_TRACE_LOGGER = logging.getLogger(__name__ + ".trace")
+_trace_sample = util.Sampler(0)
+
 
 class HomeAssistant(object):
     """ Core class to route all communication to right components. """
 
-    def __init__(self):
+    def __init__(self, precise_timers=False):
         self._pool = pool = create_worker_pool()
 
         self.bus = EventBus(pool)
         self.services = ServiceRegistry(self.bus, pool)
         self.states = StateMachine(self.bus)
+        self.scheduler = Scheduler(self.bus, pool, precise_timers)
+
+    @property
+    def stats(self):
+        """ Dict with the metrics of the worker pool and the lateness of
+        the scheduled jobs. """
+        return {'pool': self._pool.stats,
+                'scheduler_lateness': self.scheduler.lateness}
 
     def start(self):
         """ Start home assistant. """
@@ -93,80 +119,35 @@ class HomeAssistant(object):
         @ft.wraps(action)
         def state_listener(event):
             """ The listener that listens for specific state changes. """
-            if entity_id == event.data['entity_id'] and \
-                    'old_state' in event.data and \
+            if 'old_state' in event.data and \
                     _matcher(event.data['old_state'].state, from_state) and \
                     _matcher(event.data['new_state'].state, to_state):
 
-                action(event.data['entity_id'],
-                       event.data['old_state'],
-                       event.data['new_state'])
+                return action(event.data['entity_id'],
+                              event.data['old_state'],
+                              event.data['new_state'])
 
-        self.bus.listen(EVENT_STATE_CHANGED, state_listener)
+        # The bus will only schedule this listener for events of entity_id
+        self.bus.listen(EVENT_STATE_CHANGED, state_listener, entity_id)
 
     def track_point_in_time(self, action, point_in_time):
-        """ Adds a listener that fires once after a spefic point in time. """
+        """ Adds a listener that fires once after a spefic point in time.
 
-        @ft.wraps(action)
-        def point_in_time_listener(event):
-            """ Listens for matching time_changed events. """
-            now = event.data[ATTR_NOW]
-
-            if now > point_in_time and \
-               not hasattr(point_in_time_listener, 'run'):
-
-                # Set variable so that we will never run twice.
-                # Because the event bus might have to wait till a thread comes
-                # available to execute this listener it might occur that the
-                # listener gets lined up twice to be executed. This will make
-                # sure the second time it does nothing.
-                point_in_time_listener.run = True
-
-                self.bus.remove_listener(EVENT_TIME_CHANGED,
-                                         point_in_time_listener)
-
-                action(now)
-
-        self.bus.listen(EVENT_TIME_CHANGED, point_in_time_listener)
+        Returns a ScheduledJob that can be used to cancel the listener. """
+        return self.scheduler.schedule(action, point_in_time)
 
     # pylint: disable=too-many-arguments
     def track_time_change(self, action,
                           year=None, month=None, day=None,
                           hour=None, minute=None, second=None):
-        """ Adds a listener that will fire if time matches a pattern. """
-
-        # We do not have to wrap the function with time pattern matching logic
-        # if no pattern given
-        if any((val is not None for val in
-                (year, month, day, hour, minute, second))):
+        """ Adds a listener that will fire if time matches a pattern.
 
-            pmp = _process_match_param
-            year, month, day = pmp(year), pmp(month), pmp(day)
-            hour, minute, second = pmp(hour), pmp(minute), pmp(second)
+        Returns a ScheduledJob that can be used to cancel the listener. """
+        pmp = _process_match_param
 
-            @ft.wraps(action)
-            def time_listener(event):
-                """ Listens for matching time_changed events. """
-                now = event.data[ATTR_NOW]
-
-                mat = _matcher
-
-                if mat(now.year, year) and \
-                   mat(now.month, month) and \
-                   mat(now.day, day) and \
-                   mat(now.hour, hour) and \
-                   mat(now.minute, minute) and \
-                   mat(now.second, second):
-
-                    action(now)
-
-        else:
-            @ft.wraps(action)
-            def time_listener(event):
-                """ Fires every time event that comes in. """
-                action(event.data[ATTR_NOW])
-
-        self.bus.listen(EVENT_TIME_CHANGED, time_listener)
+        return self.scheduler.schedule(
+            action, pattern=(pmp(year), pmp(month), pmp(day),
+                             pmp(hour), pmp(minute), pmp(second)))
 
     def listen_once_event(self, event_type, listener):
         """ Listen once for event of a specific type.
@@ -189,11 +170,23 @@ class HomeAssistant(object):
 
                 self.bus.remove_listener(event_type, onetime_listener)
 
-                listener(event)
+                return listener(event)
 
         self.bus.listen(event_type, onetime_listener)
 
 
+def enable_trace(every):
+    """ Logs one in every `every` events, state changes, service calls and
+    pool jobs to the homeassistant.trace logger. 0 disables tracing.
+
+    The calls that are not sampled do not format anything, so this is cheap
+    enough to leave on in high traffic installations. """
+    _trace_sample.every = every
+
+    if every and _TRACE_LOGGER.level == logging.NOTSET:
+        _TRACE_LOGGER.setLevel(logging.INFO)
+
+
 def _process_match_param(parameter):
     """ Wraps parameter in a list if it is not one and returns it. """
     if not parameter:
@@ -212,6 +205,57 @@ def _matcher(subject, pattern):
     return MATCH_ALL == pattern or subject in pattern
 
 
+def _time_matches(pattern, now):
+    """ Returns True if datetime now matches pattern, a tuple (year, month,
+    day, hour, minute, second) of match parameters. """
+    mat = _matcher
+
+    return all(mat(value, match) for value, match in zip(
+        (now.year, now.month, now.day, now.hour, now.minute, now.second),
+        pattern))
+
+
+def _next_time_match(pattern, after):
+    """ Returns the first whole second after `after` that matches pattern.
+
+    Pattern is a tuple (year, month, day, hour, minute, second) of match
+    parameters. Returns None if the pattern will never match again. """
+    year, month, day, hour, minute, second = pattern
+    mat = _matcher
+
+    # Give up if no match is found within the years the pattern allows.
+    # 8 years covers every day/month combination including leap days.
+    last_year = after.year + 8 if year == MATCH_ALL else max(year)
+
+    nxt = after.replace(microsecond=0) + dt.timedelta(seconds=1)
+
+    while nxt.year <= last_year:
+        if not mat(nxt.year, year):
+            nxt = dt.datetime(nxt.year + 1, 1, 1)
+
+        elif not mat(nxt.month, month):
+            nxt = (nxt.replace(day=1, hour=0, minute=0, second=0) +
+                   dt.timedelta(days=32)).replace(day=1)
+
+        elif not mat(nxt.day, day):
+            nxt = nxt.replace(hour=0, minute=0, second=0) + \
+                dt.timedelta(days=1)
+
+        elif not mat(nxt.hour, hour):
+            nxt = nxt.replace(minute=0, second=0) + dt.timedelta(hours=1)
+
+        elif not mat(nxt.minute, minute):
+            nxt = nxt.replace(second=0) + dt.timedelta(minutes=1)
+
+        elif not mat(nxt.second, second):
+            nxt += dt.timedelta(seconds=1)
+
+        else:
+            return nxt
+
+    return None
+
+
 class JobPriority(util.OrderedEnum):
     """ Provides priorities for bus events. """
     # pylint: disable=no-init
@@ -242,6 +286,11 @@ def create_worker_pool(thread_count=POOL_NUM_THREAD):
         """ Called whenever a job is available to do. """
         try:
             func, arg = job
+
+            if _trace_sample():
+                _TRACE_LOGGER.info("WorkerPool:Doing job %s(%s)",
+                                   getattr(func, '__name__', func), arg)
+
             func(arg)
         except Exception:  # pylint: disable=broad-except
             # Catch any exception our service/event_listener might throw
@@ -254,13 +303,20 @@ def create_worker_pool(thread_count=POOL_NUM_THREAD):
 
         log_error(
             "WorkerPool:All {} threads are busy and {} jobs pending".format(
-                thread_count, pending_jobs_count))
+                len(current_jobs), pending_jobs_count))
 
         for start, job in current_jobs:
             log_error("WorkerPool:Current job from {}: {}".format(
                 util.datetime_to_str(start), job))
 
-    return util.ThreadPool(thread_count, job_handler, busy_callback)
+    # Reserve a thread for service calls and one for service calls and state
+    # changes so these never wait for slow time based pollers.
+    reserved_workers = {JobPriority.EVENT_SERVICE: 1,
+                        JobPriority.EVENT_STATE: 1}
+
+    return util.ThreadPool(thread_count, job_handler, busy_callback,
+                           max(POOL_MAX_THREAD, thread_count),
+                           reserved_workers)
 
 
 class EventOrigin(enum.Enum):
@@ -301,78 +357,142 @@ class EventBus(object):
     and events.
     """
 
-    def __init__(self, pool=None):
+    def __init__(self, pool=None, ordered=True):
+        # The listener dicts and the tuples in them are never modified.
+        # Listen and remove_listener replace them with updated copies so that
+        # fire can read them without acquiring the lock.
         self._listeners = {}
+        # Listeners that only care about events for a specific entity.
+        # Maps (event_type, entity_id) to a tuple of listeners.
+        self._entity_listeners = {}
         self._logger = logging.getLogger(__name__)
+        # Serializes the writers of the listener dicts
         self._lock = threading.Lock()
         self._pool = pool or create_worker_pool()
 
+        # If ordered, the jobs of a listener for events of the same entity
+        # are run one after the other in the order the events were fired.
+        self.ordered = ordered
+
     @property
     def listeners(self):
         """ Dict with events that is being listened for and the number
         of listeners.
         """
-        with self._lock:
-            return {key: len(self._listeners[key])
-                    for key in self._listeners}
+        listeners = {key: len(value) for key, value
+                     in self._listeners.items()}
+
+        for (event_type, _), entity_listeners in \
+                self._entity_listeners.items():
+            listeners[event_type] = \
+                listeners.get(event_type, 0) + len(entity_listeners)
+
+        return listeners
 
     def fire(self, event_type, event_data=None, origin=EventOrigin.local):
         """ Fire an event. """
-        with self._lock:
-            # Copy the list of the current listeners because some listeners
-            # remove themselves as a listener while being executed which
-            # causes the iterator to be confused.
-            get = self._listeners.get
-            listeners = get(MATCH_ALL, []) + get(event_type, [])
+        get = self._listeners.get
+        listeners = get(MATCH_ALL, ()) + get(event_type, ())
+
+        # Only listeners registered for the entity of this event get
+        # scheduled instead of every listener for the event type.
+        # Event data fired through the API can be any JSON value.
+        entity_id = event_data.get(ATTR_ENTITY_ID) \
+            if isinstance(event_data, collections.abc.Mapping) else None
+
+        if isinstance(entity_id, str):
+            listeners += self._entity_listeners.get(
+                (event_type, entity_id), ())
+        else:
+            entity_id = None
 
-            event = Event(event_type, event_data, origin)
+        event = Event(event_type, event_data, origin)
 
-            self._logger.info("Bus:Handling {}".format(event))
+        # Let the logger format the event only if the message gets logged
+        self._logger.info("Bus:Handling %s", event)
 
-            if not listeners:
-                return
+        if _trace_sample():
+            _TRACE_LOGGER.info("Bus:Handling %s", event)
+
+        if not listeners:
+            return
+
+        priority = JobPriority.from_event_type(event_type)
+
+        if entity_id is None or not self.ordered:
+            for func in listeners:
+                self._pool.add_job(priority, (func, event))
 
+        else:
             for func in listeners:
-                self._pool.add_job(JobPriority.from_event_type(event_type),
-                                  (func, event))
+                self._pool.add_job(priority, (func, event),
+                                   (func, entity_id))
 
-    def listen(self, event_type, listener):
+    def listen(self, event_type, listener, entity_id=None):
         """ Listen for all events or events of a specific type.
 
         To listen to all events specify the constant ``MATCH_ALL``
         as event_type.
+
+        If entity_id is given the listener will only be called for events
+        that have that entity_id in their event data.
         """
         with self._lock:
-            if event_type in self._listeners:
-                self._listeners[event_type].append(listener)
+            if entity_id is None:
+                listeners = dict(self._listeners)
+                key = event_type
             else:
-                self._listeners[event_type] = [listener]
+                listeners = dict(self._entity_listeners)
+                key = (event_type, entity_id)
+
+            listeners[key] = listeners.get(key, ()) + (listener,)
+
+            self._set_listeners(listeners, entity_id)
 
-    def remove_listener(self, event_type, listener):
+    def remove_listener(self, event_type, listener, entity_id=None):
         """ Removes a listener of a specific event_type. """
         with self._lock:
-            try:
-                self._listeners[event_type].remove(listener)
+            if entity_id is None:
+                listeners = dict(self._listeners)
+                key = event_type
+            else:
+                listeners = dict(self._entity_listeners)
+                key = (event_type, entity_id)
+
+            current = listeners.get(key, ())
+
+            if listener not in current:
+                return
 
-                # delete event_type list if empty
-                if not self._listeners[event_type]:
-                    self._listeners.pop(event_type)
+            # Remove the first occurrence like list.remove does
+            index = current.index(listener)
+            current = current[:index] + current[index+1:]
 
-            except (KeyError, AttributeError):
-                # KeyError is key event_type listener did not exist
-                # AttributeError if listener did not exist within event_type
-                pass
+            # delete event_type if no listeners left
+            if current:
+                listeners[key] = current
+            else:
+                listeners.pop(key)
+
+            self._set_listeners(listeners, entity_id)
+
+    def _set_listeners(self, listeners, entity_id):
+        """ Replaces the listener dict that entity_id belongs to. """
+        if entity_id is None:
+            self._listeners = listeners
+        else:
+            self._entity_listeners = listeners
 
 
 class State(object):
-    """ Object to represent a state within the state machine. """
+    """ Object to represent a state within the state machine.
+
+    States are immutable so they can be shared without copying. Attributes
+    are a read-only mapping. """
 
     __slots__ = ['entity_id', 'state', 'attributes', 'last_changed']
 
     def __init__(self, entity_id, state, attributes=None, last_changed=None):
-        self.entity_id = entity_id
-        self.state = state
-        self.attributes = attributes or {}
         last_changed = last_changed or dt.datetime.now()
 
         # Strip microsecond from last_changed else we cannot guarantee
@@ -380,15 +500,25 @@ class State(object):
         # This behavior occurs because to_dict uses datetime_to_str
         # which strips microseconds
         if last_changed.microsecond:
-            self.last_changed = last_changed - dt.timedelta(
+            last_changed -= dt.timedelta(
                 microseconds=last_changed.microsecond)
-        else:
-            self.last_changed = last_changed
+
+        # Copy attributes so later changes to the passed in dict do not
+        # leak into this state.
+        setattr_ = object.__setattr__
+        setattr_(self, 'entity_id', entity_id)
+        setattr_(self, 'state', state)
+        setattr_(self, 'attributes',
+                 types.MappingProxyType(dict(attributes or {})))
+        setattr_(self, 'last_changed', last_changed)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("State objects are immutable")
 
     def copy(self):
-        """ Creates a copy of itself. """
-        return State(self.entity_id, self.state,
-                     dict(self.attributes), self.last_changed)
+        """ Returns the state. Kept for compatibility, states are immutable
+        and do not need to be copied anymore. """
+        return self
 
     def as_dict(self):
         """ Converts State to a dict to be used within JSON.
@@ -396,7 +526,7 @@ class State(object):
 
         return {'entity_id': self.entity_id,
                 'state': self.state,
-                'attributes': self.attributes,
+                'attributes': dict(self.attributes),
                 'last_changed': util.datetime_to_str(self.last_changed)}
 
     @classmethod
@@ -440,22 +570,63 @@ class StateMachine(object):
         self._bus = bus
         self._lock = threading.Lock()
 
+        # Every change gets the next sequence number. Every entity keeps a
+        # version that increases with each of its changes. The last
+        # CHANGE_LOG_SIZE changes are kept as (sequence, entity_id) tuples.
+        # Sequence numbers start over every run, run_id tells runs apart.
+        self.run_id = uuid.uuid4().hex
+        self._sequence = 0
+        self._versions = {}
+        self._changes = collections.deque(maxlen=CHANGE_LOG_SIZE)
+
     @property
     def entity_ids(self):
         """ List of entity ids that are being tracked. """
         return list(self._states.keys())
 
+    @property
+    def sequence(self):
+        """ Sequence number of the last change. """
+        return self._sequence
+
+    def get_version(self, entity_id):
+        """ Returns how many times the state of entity_id changed,
+            including removals, 0 if it never existed. """
+        return self._versions.get(entity_id, 0)
+
+    def changes_since(self, sequence):
+        """ Returns a tuple (sequence, states) with the current sequence
+        number and a dict mapping the entity ids that changed after the given
+        sequence number to their current state, None if it was removed.
+
+        Returns None if the change log does not go back far enough, the
+        caller should get all states instead. """
+        with self._lock:
+            if sequence > self._sequence:
+                return None
+
+            # The oldest change in the log has to directly follow sequence
+            if sequence < self._sequence - len(self._changes):
+                return None
+
+            states = {}
+
+            for change_sequence, entity_id in reversed(self._changes):
+                if change_sequence <= sequence:
+                    break
+
+                states[entity_id] = self._states.get(entity_id)
+
+            return self._sequence, states
+
     def all(self):
         """ Returns a dict mapping all entity_ids to their state. """
-        return {entity_id: state.copy() for entity_id, state
-                in self._states.items()}
+        # States are immutable, a shallow copy of the dict is a snapshot
+        return dict(self._states)
 
     def get(self, entity_id):
         """ Returns the state of the specified entity. """
-        state = self._states.get(entity_id)
-
-        # Make a copy so people won't mutate the state
-        return state.copy() if state else None
+        return self._states.get(entity_id)
 
     def is_state(self, entity_id, state):
         """ Returns True if entity exists and is specified state. """
@@ -467,32 +638,84 @@ class StateMachine(object):
 
         Returns boolean to indicate if a entity was removed. """
         with self._lock:
-            return self._states.pop(entity_id, None) is not None
+            if self._states.pop(entity_id, None) is None:
+                return False
+
+            # Keep counting so the version does not go back if the entity
+            # is added again
+            self._versions[entity_id] += 1
+            self._log_change(entity_id)
+
+            return True
+
+    def restore(self, states):
+        """ Adds the given State objects, for example saved by a previous
+        run, for entities that do not have a state yet.
+
+        Keeps last_changed and does not fire state_changed events, so this is
+        meant to be called before components are set up. """
+        with self._lock:
+            for state in states:
+                if state.entity_id not in self._states:
+                    self._states[state.entity_id] = state
+
+                    self._versions[state.entity_id] = \
+                        self._versions.get(state.entity_id, 0) + 1
+                    self._log_change(state.entity_id)
 
     def set(self, entity_id, new_state, attributes=None):
         """ Set the state of an entity, add entity if it does not exist.
 
         Attributes is an optional dict to specify attributes of this state. """
 
-        attributes = attributes or {}
+        with self._lock:
+            self._set(entity_id, new_state, attributes)
+
+    def set_multiple(self, states):
+        """ Set the state of multiple entities at once.
+
+        States is an iterable of (entity_id, new_state, attributes) tuples,
+        attributes may be None. The states are set while holding the lock
+        once and a state_changed event is fired per changed entity. """
 
         with self._lock:
-            old_state = self._states.get(entity_id)
+            for entity_id, new_state, attributes in states:
+                self._set(entity_id, new_state, attributes)
+
+    def _set(self, entity_id, new_state, attributes):
+        """ Sets the state of an entity and fires the state_changed event if
+        it changed. Expects the lock to be held. """
+        attributes = attributes or {}
 
-            # If state did not exist or is different, set it
-            if not old_state or \
-               old_state.state != new_state or \
-               old_state.attributes != attributes:
+        old_state = self._states.get(entity_id)
 
-                state = self._states[entity_id] = \
-                    State(entity_id, new_state, attributes)
+        # If state did not exist or is different, set it
+        if not old_state or \
+           old_state.state != new_state or \
+           old_state.attributes != attributes:
 
-                event_data = {'entity_id': entity_id, 'new_state': state}
+            state = self._states[entity_id] = \
+                State(entity_id, new_state, attributes)
 
-                if old_state:
-                    event_data['old_state'] = old_state
+            self._versions[entity_id] = self._versions.get(entity_id, 0) + 1
+            self._log_change(entity_id)
 
-                self._bus.fire(EVENT_STATE_CHANGED, event_data)
+            event_data = {'entity_id': entity_id, 'new_state': state}
+
+            if old_state:
+                event_data['old_state'] = old_state
+
+            if _trace_sample():
+                _TRACE_LOGGER.info("StateMachine:Setting %s to %s",
+                                   entity_id, state)
+
+            self._bus.fire(EVENT_STATE_CHANGED, event_data)
+
+    def _log_change(self, entity_id):
+        """ Stamps a change of entity_id with the next sequence number.
+        Expects the lock to be held. """
+        self._sequence += 1
+        self._changes.append((self._sequence, entity_id))
 
 
 # pylint: disable=too-few-public-methods
@@ -552,9 +775,216 @@ class ServiceRegistry(object):
             if domain in self._services and service in self._services[domain]:
                 service_call = ServiceCall(domain, service, service_data)
 
+                if _trace_sample():
+                    _TRACE_LOGGER.info("ServiceRegistry:Calling %s",
+                                       service_call)
+
                 self._pool.add_job(JobPriority.EVENT_SERVICE,
-                                  (self._services[domain][service],
-                                   service_call))
+                                   (self._services[domain][service],
+                                    service_call))
+
+
+class ScheduledJob(object):
+    """ Represents an action that is scheduled to run at a point in time
+    or every time the time matches a pattern. """
+
+    __slots__ = ['action', 'next_run', 'pattern', 'cancelled']
+
+    def __init__(self, action, next_run, pattern=None):
+        self.action = action
+        self.next_run = next_run
+        self.pattern = pattern
+        self.cancelled = False
+
+    @property
+    def name(self):
+        """ Name of the action of this job. """
+        return getattr(self.action, '__name__', repr(self.action))
+
+    def cancel(self):
+        """ Prevents the job from being run again. """
+        self.cancelled = True
+
+    def __repr__(self):
+        return "<ScheduledJob {} @ {}>".format(
+            self.name, util.datetime_to_str(self.next_run))
+
+
+class Scheduler(object):
+    """ Keeps the scheduled jobs ordered by their next run time and only
+    hands the jobs that are due to the worker pool.
+
+    By default jobs are checked every time a time_changed event comes in.
+    In precise mode point in time jobs are run from a separate thread as
+    soon as their deadline passes, independent of TIMER_INTERVAL. """
+
+    def __init__(self, bus, pool=None, precise=False):
+        # Heaps of (deadline, sequence, job) tuples. The sequence number
+        # keeps jobs with the same deadline in order of scheduling.
+        # Deadlines of jobs checked on time_changed events are datetimes,
+        # compared against the time of the event so they follow DST and
+        # clock changes. Precise deadlines are based on time.monotonic so
+        # the precise worker can sleep till them.
+        self._jobs = []
+        self._precise_jobs = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._pool = pool or create_worker_pool()
+        self._logger = logging.getLogger(__name__)
+
+        # Observed lateness per action name: [run count, total, max]
+        self._lateness = {}
+
+        self.precise = precise
+
+        bus.listen(EVENT_TIME_CHANGED, self._time_changed_listener)
+
+        if precise:
+            thread = threading.Thread(target=self._precise_worker)
+            thread.daemon = True
+            thread.start()
+
+    @property
+    def jobs(self):
+        """ List of jobs that are scheduled to run. """
+        with self._lock:
+            # Precise deadlines are monotonic, turn them into wall clock
+            # time so they can be ordered together with the other jobs.
+            now, monotonic_now = dt.datetime.now(), time.monotonic()
+
+            scheduled = self._jobs + [
+                (now + dt.timedelta(seconds=deadline - monotonic_now),
+                 sequence, job)
+                for deadline, sequence, job in self._precise_jobs]
+
+            return [job for _, _, job in sorted(scheduled)
+                    if not job.cancelled]
+
+    @property
+    def lateness(self):
+        """ Dict with per action the number of runs and the average and
+        maximum number of seconds the action started after its deadline. """
+        with self._lock:
+            return {name: {'count': count,
+                           'average': total / count,
+                           'max': maximum}
+                    for name, (count, total, maximum)
+                    in self._lateness.items()}
+
+    def schedule(self, action, point_in_time=None, pattern=None):
+        """ Schedules action to be called with the current time once after
+        point_in_time or every time the time matches pattern.
+
+        Returns the ScheduledJob. """
+        if pattern:
+            next_run = _next_time_match(pattern, dt.datetime.now())
+        else:
+            next_run = point_in_time
+
+        job = ScheduledJob(action, next_run, pattern)
+
+        if next_run is not None:
+            with self._lock:
+                self._push(job)
+
+        return job
+
+    def _push(self, job):
+        """ Adds job to the heap it belongs on. Expects the lock to be held.
+
+        Pattern jobs are always checked on time_changed events because their
+        resolution is the timer interval. """
+        if self.precise and not job.pattern:
+            deadline = time.monotonic() + \
+                (job.next_run - dt.datetime.now()).total_seconds()
+
+            heapq.heappush(self._precise_jobs,
+                           (deadline, next(self._sequence), job))
+
+            # Wake up the precise worker to recalculate its sleep
+            self._condition.notify()
+
+        else:
+            heapq.heappush(self._jobs,
+                           (job.next_run, next(self._sequence), job))
+
+    def _pop_due(self, jobs, now, current):
+        """ Pops the jobs from heap jobs with a deadline up to current and
+        hands them to the pool. Expects the lock to be held. Returns the time
+        till the next deadline. """
+        repeat = []
+
+        while jobs and jobs[0][0] <= current:
+            deadline, _, job = heapq.heappop(jobs)
+
+            if job.cancelled:
+                continue
+
+            if job.pattern:
+                repeat.append(job)
+
+                # The tick came after the window of the pattern closed, as
+                # the pattern is checked at the resolution of the timer.
+                # Wait for the next match instead of running it now.
+                if not _time_matches(job.pattern, now):
+                    continue
+
+            else:
+                job.cancelled = True
+
+            self._pool.add_job(JobPriority.EVENT_TIME,
+                               (self._run_job, (job, deadline, now)))
+
+        # Reschedule pattern jobs after the loop so that a job runs at most
+        # once per call, even if its next run is already due.
+        for job in repeat:
+            job.next_run = _next_time_match(job.pattern, now)
+
+            if job.next_run is not None:
+                self._push(job)
+
+        return jobs[0][0] - current if jobs else None
+
+    def _run_job(self, job_deadline_now):
+        """ Runs a job from the worker pool and records how late it started
+        compared to the deadline it was due for. """
+        job, deadline, now = job_deadline_now
+
+        if isinstance(deadline, dt.datetime):
+            lateness = (dt.datetime.now() - deadline).total_seconds()
+        else:
+            lateness = time.monotonic() - deadline
+
+        with self._lock:
+            if job.name in self._lateness:
+                count, total, maximum = self._lateness[job.name]
+
+                self._lateness[job.name] = \
+                    (count + 1, total + lateness, max(maximum, lateness))
+            else:
+                self._lateness[job.name] = (1, lateness, lateness)
+
+        self._logger.debug("Scheduler:Running %s %.3fs late", job, lateness)
+
+        return job.action(now or dt.datetime.now())
+
+    def _time_changed_listener(self, event):
+        """ Hands the jobs that are due to the worker pool. """
+        with self._lock:
+            now = event.data[ATTR_NOW]
+
+            self._pop_due(self._jobs, now, now)
+
+    def _precise_worker(self):
+        """ Sleeps until the next point in time job is due and runs it. """
+        with self._condition:
+            while True:
+                # Pass now=None so the job gets the time it actually runs
+                timeout = self._pop_due(
+                    self._precise_jobs, None, time.monotonic())
+
+                self._condition.wait(timeout)
 
 
 class Timer(threading.Thread):
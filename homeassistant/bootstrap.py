@@ -12,6 +12,7 @@ import configparser
 import logging
 
 import homeassistant
+import homeassistant.eventloop as eventloop
 import homeassistant.components as components
 
 
@@ -43,9 +44,6 @@ def from_config_file(config_path, enable_logging=True):
     config = configparser.ConfigParser()
     config.read(config_path)
 
-    # Init core
-    hass = homeassistant.HomeAssistant()
-
     has_opt = config.has_option
     get_opt = config.get
     has_section = config.has_section
@@ -67,6 +65,42 @@ def from_config_file(config_path, enable_logging=True):
         else:
             return None
 
+    # Log a sample of the traffic through the core
+    if has_opt("common", "trace_sample"):
+        homeassistant.enable_trace(config.getint("common", "trace_sample"))
+
+    # Init core
+    precise_timers = get_opt_safe("common", "precise_timers") == "1"
+
+    if get_opt_safe("common", "core") == "asyncio":
+        hass = eventloop.HomeAssistant(precise_timers)
+    else:
+        hass = homeassistant.HomeAssistant(precise_timers)
+
+    # Restore the states of the previous run before components set theirs
+    if has_opt("state_store", "path"):
+        add_status("State store", load_module('state_store').setup(
+            hass, get_opt("state_store", "path")))
+
+    # Recorder
+    if has_opt("recorder", "path"):
+        keep_days = get_opt_safe("recorder", "keep_days")
+
+        add_status("Recorder", load_module('recorder').setup(
+            hass, get_opt("recorder", "path"),
+            int(keep_days) if keep_days else None))
+
+    # History
+    history = None
+
+    if has_section("history"):
+        max_points = get_opt_safe("history", "max_points")
+
+        history = load_module('history').History(
+            hass, int(max_points) if max_points else None)
+
+        add_status("History", True)
+
     # Device scanner
     dev_scan = None
 
@@ -197,7 +231,12 @@ def from_config_file(config_path, enable_logging=True):
     if has_opt("http", "api_password"):
         http = load_module('http')
 
-        http.setup(hass, get_opt("http", "api_password"))
+        compression_level = get_opt_safe("http", "compression_level")
+
+        http.setup(hass, get_opt("http", "api_password"), history=history,
+                   use_asyncio=get_opt_safe("http", "server") == "asyncio",
+                   compression_level=int(compression_level)
+                   if compression_level else None)
 
         add_status("HTTP", True)
 
@@ -107,6 +107,8 @@ class DeviceTracker(object):
         temp_tracking_devices = [device for device in known_dev
                                  if known_dev[device]['track']]
 
+        new_states = []
+
         for device in found_devices:
             # Are we tracking this device?
             if device in temp_tracking_devices:
@@ -114,8 +116,9 @@ class DeviceTracker(object):
 
                 known_dev[device]['last_seen'] = now
 
-                self.states.set(
-                    known_dev[device]['entity_id'], components.STATE_HOME)
+                new_states.append(
+                    (known_dev[device]['entity_id'], components.STATE_HOME,
+                     None))
 
         # For all devices we did not find, set state to NH
         # But only if they have been gone for longer then the error time span
@@ -124,8 +127,11 @@ class DeviceTracker(object):
         for device in temp_tracking_devices:
             if now - known_dev[device]['last_seen'] > self.error_scanning:
 
-                self.states.set(known_dev[device]['entity_id'],
-                                components.STATE_NOT_HOME)
+                new_states.append(
+                    (known_dev[device]['entity_id'], components.STATE_NOT_HOME,
+                     None))
+
+        self.states.set_multiple(new_states)
 
         # If we come along any unknown devices we will write them to the
         # known devices file but only if we did not encounter an invalid
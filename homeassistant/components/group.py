@@ -6,6 +6,7 @@ Provides functionality to group devices that can be turned on or off.
 """
 
 import logging
+import threading
 
 import homeassistant.util as util
 from homeassistant.components import (STATE_ON, STATE_OFF,
@@ -146,27 +147,32 @@ def setup(hass, name, entity_ids):
     group_entity_id = ENTITY_ID_FORMAT.format(name)
     state_attr = {ATTR_ENTITY_ID: entity_ids}
 
+    # Changes of different entities are handled in parallel. Updating the
+    # group state has to happen one at a time to not act on stale states.
+    lock = threading.Lock()
+
     # pylint: disable=unused-argument
     def update_group_state(entity_id, old_state, new_state):
         """ Updates the group state based on a state change by a tracked
             entity. """
 
-        cur_group_state = hass.states.get(group_entity_id).state
+        with lock:
+            cur_group_state = hass.states.get(group_entity_id).state
 
-        # if cur_group_state = OFF and new_state = ON: set ON
-        # if cur_group_state = ON and new_state = OFF: research
-        # else: ignore
+            # if cur_group_state = OFF and new_state = ON: set ON
+            # if cur_group_state = ON and new_state = OFF: research
+            # else: ignore
 
-        if cur_group_state == group_off and new_state.state == group_on:
+            if cur_group_state == group_off and new_state.state == group_on:
 
-            hass.states.set(group_entity_id, group_on, state_attr)
+                hass.states.set(group_entity_id, group_on, state_attr)
 
-        elif cur_group_state == group_on and new_state.state == group_off:
+            elif cur_group_state == group_on and new_state.state == group_off:
 
-            # Check if any of the other states is still on
-            if not any([hass.states.is_state(ent_id, group_on)
-                        for ent_id in entity_ids if entity_id != ent_id]):
-                hass.states.set(group_entity_id, group_off, state_attr)
+                # Check if any of the other states is still on
+                if not any([hass.states.is_state(ent_id, group_on)
+                            for ent_id in entity_ids if entity_id != ent_id]):
+                    hass.states.set(group_entity_id, group_off, state_attr)
 
     for entity_id in entity_ids:
         hass.track_state_change(entity_id, update_group_state)
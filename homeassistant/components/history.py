@@ -0,0 +1,151 @@
+"""
+homeassistant.components.history
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Keeps a timeline of the recent states of every entity in memory so that the
+API can answer what an entity did over the last day.
+
+Each timeline stores the times and states in two ring buffers that hold at
+most max_points changes, so memory use is bounded no matter how busy an
+entity is. Only changes of the state are stored, not of the attributes.
+"""
+import bisect
+import itertools
+import threading
+import collections
+
+import homeassistant as ha
+
+DOMAIN = "history"
+
+# Number of state changes to keep per entity
+DEFAULT_MAX_POINTS = 1000
+
+
+class Timeline(object):
+    """ The recent state changes of one entity. """
+
+    def __init__(self, max_points):
+        # Columns of timestamps and states, oldest first
+        self.times = collections.deque(maxlen=max_points)
+        self.states = collections.deque(maxlen=max_points)
+
+    def add(self, timestamp, state):
+        """ Adds a state change if the state differs from the last one. """
+        if not self.states or self.states[-1] != state:
+            self.times.append(timestamp)
+            self.states.append(state)
+
+    def points(self, start, end):
+        """ Returns a list of (timestamp, state) tuples of the changes
+        between start and end. The first point is the state at start. """
+        # Include the change before start, it is the state at start
+        index = max(bisect.bisect_right(self.times, start) - 1, 0)
+
+        points = []
+
+        for timestamp, state in itertools.islice(
+                zip(self.times, self.states), index, None):
+
+            if timestamp > end:
+                break
+
+            points.append((max(timestamp, start), state))
+
+        return points
+
+
+def downsample(points, start, end, buckets):
+    """ Reduces a list of (timestamp, state) points to one point per bucket
+    of equal length between start and end. Each bucket gets the state that
+    lasted longest within it. """
+    width = (end - start) / buckets
+
+    result = []
+    index = 0
+
+    for bucket in range(buckets):
+        bucket_start = start + bucket * width
+        bucket_end = bucket_start + width
+
+        durations = collections.Counter()
+
+        # Skip points that are replaced by a later point before this bucket
+        while index + 1 < len(points) and \
+                points[index + 1][0] <= bucket_start:
+            index += 1
+
+        number = index
+
+        while number < len(points) and points[number][0] < bucket_end:
+            timestamp, state = points[number]
+
+            next_time = points[number + 1][0] \
+                if number + 1 < len(points) else end
+
+            durations[state] += \
+                min(next_time, bucket_end) - max(timestamp, bucket_start)
+
+            number += 1
+
+        if durations:
+            result.append((bucket_start, durations.most_common(1)[0][0]))
+
+    return result
+
+
+class History(object):
+    """ Keeps the timelines of all entities. """
+
+    def __init__(self, hass, max_points=None):
+        self.max_points = max_points or DEFAULT_MAX_POINTS
+
+        self._lock = threading.Lock()
+        self._timelines = {}
+
+        for state in hass.states.all().values():
+            self._add(state)
+
+        hass.bus.listen(ha.EVENT_STATE_CHANGED, self._state_changed_listener)
+
+    @property
+    def entity_ids(self):
+        """ List of entity ids that have a timeline. """
+        return list(self._timelines)
+
+    def get_points(self, entity_id, start, end, buckets=None):
+        """ Returns a list of (timestamp, state) tuples describing the
+        states of entity_id between datetimes start and end.
+
+        If buckets is given, returns at most that many points of evenly
+        spaced time periods instead. """
+        start, end = start.timestamp(), end.timestamp()
+
+        with self._lock:
+            timeline = self._timelines.get(entity_id)
+
+            points = timeline.points(start, end) if timeline else []
+
+        if buckets:
+            points = downsample(points, start, end, buckets)
+
+        return points
+
+    def _add(self, state):
+        """ Adds a state to the timeline of its entity. """
+        with self._lock:
+            timeline = self._timelines.get(state.entity_id)
+
+            if timeline is None:
+                timeline = self._timelines[state.entity_id] = \
+                    Timeline(self.max_points)
+
+            timeline.add(state.last_changed.timestamp(), state.state)
+
+    def _state_changed_listener(self, event):
+        """ Adds the new state to the timeline. """
+        state = event.data.get('new_state')
+
+        # Fired through the API with a state that could not be decoded
+        if isinstance(state, ha.State):
+            self._add(state)
@@ -64,6 +64,104 @@ Example result:
     "state": "below_horizon"
 }
 
+/api/states - POST
+Updates the states of multiple entities in one request. Returns a list with
+for each submitted state the new state or a message why it was rejected.
+parameter: states - JSON encoded list of objects with an entity_id, a state
+                    string and optionally attributes
+Example result:
+[
+    {
+        "attributes": {},
+        "entity_id": "device_tracker.paulus",
+        "last_changed": "23:24:33 28-10-2013",
+        "state": "home"
+    },
+    {
+        "message": "Invalid entity_id"
+    }
+]
+
+/api/changes - GET
+Returns the states that changed since the sequence given in optional
+parameter since, which is the sequence of an earlier result. A removed
+entity has state null. If since is omitted, too old to answer or from before
+a restart, all states are returned and complete is true.
+Example result:
+{
+    "complete": false,
+    "sequence": "5f0c8b6e2a1d4c3b9e7f6a5d4c3b2a19-1542",
+    "states": {
+        "weather.sun": {
+            "attributes": {
+                "next_rising": "07:04:15 29-10-2013",
+                "next_setting": "18:00:31 29-10-2013"
+            },
+            "entity_id": "weather.sun",
+            "last_changed": "23:24:33 28-10-2013",
+            "state": "below_horizon"
+        }
+    }
+}
+
+/api/history - GET
+Returns the states of entities between optional parameters start and end,
+which default to a day ago and now. Optional parameter entity_id is a comma
+separated list of entities, all entities if omitted. Optional parameter
+buckets reduces the result to one point per bucket of equal duration with the
+state that lasted longest in it, at most as many buckets as the history keeps
+changes per entity. Requires the history component.
+Example result:
+{
+    "device_tracker.paulus": [
+        ["23:24:33 28-10-2013", "home"],
+        ["07:41:10 29-10-2013", "not_home"]
+    ]
+}
+
+/api/history/<entity_id> - GET
+Same as /api/history for a single entity.
+
+/api/stream - GET
+Streams the events fired on the bus as server-sent events over a single
+response. Every event is sent as a data line with a JSON encoded object.
+optional parameter: event_type - comma separated event types to stream
+optional parameter: entity_id - comma separated entity ids, only streams
+                               events with one of these in their data
+Clients that fall more than STREAM_QUEUE_SIZE events behind are disconnected.
+Example event:
+data: {"data": {"entity_id": "light.bowl"}, "event_type": "state_changed",
+       "origin": "LOCAL"}
+
+/api/stats - GET
+Returns metrics of the worker pool and, per scheduled action, how many
+seconds it started after its deadline. Times are in seconds.
+Example result:
+{
+    "pool": {
+        "average_run_time": 0.002,
+        "average_wait_time": 0.0004,
+        "idle_workers": 3,
+        "jobs_done": 1542,
+        "max_wait_time": 0.05,
+        "queue_depth": 0,
+        "running_jobs": 1,
+        "workers": 4
+    },
+    "scheduler_lateness": {
+        "update_sun_state": {"average": 0.51, "count": 12, "max": 0.6}
+    }
+}
+
+/api/events - POST
+Fires multiple events in one request, in the order given.
+parameter: events - JSON encoded list of objects with an event_type and
+                    optionally event_data
+Example result:
+{
+    "message": "2 events fired."
+}
+
 /api/events/<event_type> - POST
 Fires an event with event_type
 optional parameter: event_data - JSON encoded object
@@ -74,14 +172,26 @@ Example result:
 
 """
 
+import io
 import json
+import zlib
+import time
+import hashlib
+import functools
+import shutil
+import mimetypes
+import email.utils
+import asyncio
+import collections
 import threading
 import logging
 import re
 import os
+import socket
+import selectors
+import datetime as dt
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from socketserver import ThreadingMixIn
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, urlencode
 
 import homeassistant as ha
 import homeassistant.remote as rem
@@ -90,6 +200,7 @@ import homeassistant.util as util
 HTTP_OK = 200
 HTTP_CREATED = 201
 HTTP_MOVED_PERMANENTLY = 301
+HTTP_NOT_MODIFIED = 304
 HTTP_BAD_REQUEST = 400
 HTTP_UNAUTHORIZED = 401
 HTTP_NOT_FOUND = 404
@@ -103,16 +214,80 @@ URL_CALL_SERVICE = "/call_service"
 
 URL_STATIC = "/static/{}"
 
+# Threads handling connections, grows up to the maximum when busy
+POOL_NUM_THREAD = 4
+POOL_MAX_THREAD = 32
+
+# Seconds a persistent connection may be idle before it is closed
+KEEP_ALIVE_TIMEOUT = 10
+
+# Idle connections are cheap for the asyncio server, keep them longer
+ASYNC_KEEP_ALIVE_TIMEOUT = 300
+
+# Compact JSON without spaces after separators
+JSON_SEPARATORS = (',', ':')
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), 'www_static')
+
+# Seconds browsers may use static files without asking again
+STATIC_MAX_AGE = 86400
+
+# Rows of the states table on a page of the debug interface
+STATES_PER_PAGE = 100
+
+# Bytes to collect before sending a chunk of a chunked response
+CHUNK_SIZE = 16384
 
-def setup(hass, api_password, server_port=None, server_host=None):
-    """ Sets up the HTTP API and debug interface. """
+# Events a stream client may fall behind before it is disconnected
+STREAM_QUEUE_SIZE = 1000
+
+# Seconds between keep alive comments when no events are streamed
+STREAM_PING_INTERVAL = 30
+
+# zlib level to compress responses with, 1 is fastest and 9 is smallest
+COMPRESS_LEVEL = 6
+
+# Responses smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+# Content encodings we can compress with, in order of preference, and the
+# zlib window bits that produce their format
+COMPRESS_WBITS = collections.OrderedDict(
+    (('gzip', 16 + zlib.MAX_WBITS), ('deflate', zlib.MAX_WBITS)))
+
+RE_CONTENT_LENGTH = re.compile(br'\r\ncontent-length:\s*(\d+)', re.IGNORECASE)
+
+RE_NAMED_GROUP = re.compile(r'\(\?P<[a-zA-Z_0-9]+>')
+
+# Entity ids accepted by the API, the same as in the /api/states routes
+RE_ENTITY_ID = re.compile(r'[a-zA-Z\._0-9]+')
+
+
+# pylint: disable=too-many-arguments
+def setup(hass, api_password, server_port=None, server_host=None,
+          history=None, use_asyncio=False, compression_level=None):
+    """ Sets up the HTTP API and debug interface.
+
+    history is an optional history.History to answer /api/history with.
+    use_asyncio serves the requests from an asyncio event loop.
+    compression_level is the zlib level to compress responses with for
+    clients that accept it, 0 disables compression. """
     server_port = server_port or rem.SERVER_PORT
 
     # If no server host is given, accept all incoming requests
     server_host = server_host or '0.0.0.0'
 
-    server = HomeAssistantHTTPServer((server_host, server_port),
-                                     RequestHandler, hass, api_password)
+    if use_asyncio:
+        server = AsyncioHTTPServer((server_host, server_port),
+                                   BufferedRequestHandler, hass, api_password)
+    else:
+        server = HomeAssistantHTTPServer((server_host, server_port),
+                                         RequestHandler, hass, api_password)
+
+    server.history = history
+
+    if compression_level is not None:
+        server.compression_level = compression_level
 
     hass.listen_once_event(
         ha.EVENT_HOMEASSISTANT_START,
@@ -124,8 +299,86 @@ def setup(hass, api_password, server_port=None, server_host=None):
         hass.local_api = rem.API(util.get_local_ip(), api_password, server_port)
 
 
-class HomeAssistantHTTPServer(ThreadingMixIn, HTTPServer):
-    """ Handle HTTP requests in a threaded fashion. """
+class Router(object):
+    """ Finds the handler for a method and path without trying every route.
+
+    Routes are (method, path, handler) tuples. Paths that are strings have to
+    match exactly and are looked up in a dict. Paths that are compiled regular
+    expressions are combined per method into a single expression with one
+    group per route, so one match call tells which route matched.
+
+    Exact paths are looked up first. Among the regular expressions the first
+    route in the list wins, just like with a linear search. """
+
+    def __init__(self, routes):
+        self._exact = {}
+        self._exact_paths = set()
+
+        # Maps method to (combined regex, list of (regex, handler) tuples)
+        self._patterns = {}
+
+        patterns = {}
+
+        for method, path, handler in routes:
+            if isinstance(path, str):
+                self._exact.setdefault((method, path), handler)
+                self._exact_paths.add(path)
+            else:
+                patterns.setdefault(method, []).append((path, handler))
+
+        for method, method_routes in patterns.items():
+            # Named groups may be used by multiple routes, drop them from the
+            # combined regex. The route's own regex gets the groups.
+            combined = "|".join(
+                "(?P<route{}>{})".format(
+                    index, RE_NAMED_GROUP.sub("(?:", path.pattern))
+                for index, (path, _) in enumerate(method_routes))
+
+            self._patterns[method] = (re.compile(combined), method_routes)
+
+        # Used to tell apart unknown paths and paths with another method
+        any_method = "|".join(
+            "(?:{})".format(RE_NAMED_GROUP.sub("(?:", combined.pattern))
+            for combined, _ in self._patterns.values())
+
+        self._any_method = re.compile(any_method or "(?!)")
+
+    def match(self, method, path):
+        """ Returns a (handler, path_match) tuple for method and path.
+
+        path_match is True for exact paths and a match object for regular
+        expressions. Handler is None if there is no route for path. Handler
+        is False if there are routes for path but not for method. """
+        handler = self._exact.get((method, path))
+
+        if handler:
+            return handler, True
+
+        if method in self._patterns:
+            combined, method_routes = self._patterns[method]
+
+            match = combined.match(path)
+
+            if match:
+                # The route group is the last group to close
+                route, handler = method_routes[int(match.lastgroup[5:])]
+
+                return handler, route.match(path)
+
+        if path in self._exact_paths or self._any_method.match(path):
+            return False, None
+
+        return None, None
+
+
+class HomeAssistantHTTPServer(HTTPServer):
+    """ Handle HTTP requests with a pool of worker threads.
+
+    Workers handle requests, not connections. Between two requests the
+    server thread parks a persistent connection in a selector. It hands the
+    connection back to the pool when the next request comes in and closes it
+    when it is idle for KEEP_ALIVE_TIMEOUT seconds, so idle connections do not
+    hold a worker. Event streams get a thread of their own. """
 
     def __init__(self, server_address, RequestHandlerClass,
                  hass, api_password):
@@ -135,23 +388,785 @@ class HomeAssistantHTTPServer(ThreadingMixIn, HTTPServer):
         self.api_password = api_password
         self.logger = logging.getLogger(__name__)
 
+        self._pool = util.ThreadPool(
+            POOL_NUM_THREAD, self._handle_connection,
+            lambda current_jobs, pending_jobs_count:
+            self.logger.warning(
+                "HTTP server is busy, %d requests waiting",
+                pending_jobs_count),
+            POOL_MAX_THREAD)
+
+        # Maps parked connections to (handler, time parked)
+        self._selector = selectors.DefaultSelector()
+        self._last_idle_check = 0
+
+        # Workers hand connections to park to the server thread and wake it
+        self._to_park = collections.deque()
+        self._wakeup_read, self._wakeup_write = socket.socketpair()
+        self._wakeup_read.setblocking(False)
+        self._wakeup_write.setblocking(False)
+
         # To store flash messages between sessions
         self.flash_message = None
 
         # We will lazy init this one if needed
         self.event_forwarder = None
 
+        # Set by setup if the history component is used
+        self.history = None
+
+        self.compression_level = COMPRESS_LEVEL
+
+        self.event_stream = EventStream(hass)
+
+        self.state_json = StateJSONCache(hass)
+
     def start(self):
         """ Starts the server. """
         self.logger.info("Starting")
 
-        self.serve_forever()
+        self._selector.register(self.socket, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ)
+
+        while True:
+            for key, _ in self._selector.select(1):
+                if key.fileobj is self.socket:
+                    # Accepts the connection and calls process_request
+                    self._handle_request_noblock()
+
+                elif key.fileobj is self._wakeup_read:
+                    self._wakeup_read.recv(4096)
+
+                else:
+                    self._selector.unregister(key.fileobj)
+                    self._pool.add_job(0, key.data[0])
+
+            while self._to_park:
+                self._park(self._to_park.popleft())
+
+            self._close_idle()
+
+    def process_request(self, request, client_address):
+        """ Parks a new connection till its first request comes in. """
+        # Sets up the handler like BaseRequestHandler.__init__ does, but
+        # leaves handling the requests to _handle_connection
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.request = request
+        handler.client_address = client_address
+        handler.server = self
+
+        try:
+            handler.setup()
+
+        except OSError:
+            self.shutdown_request(request)
+            return
+
+        self._park(handler)
+
+    def _park(self, handler):
+        """ Waits in the selector for the next request of a connection.
+            Only call from the server thread. """
+        try:
+            self._selector.register(
+                handler.request, selectors.EVENT_READ,
+                (handler, time.monotonic()))
+
+        except (OSError, ValueError):
+            # Connection was closed
+            self._close(handler)
+
+    def _close_idle(self):
+        """ Closes connections that are parked for too long. Only call from
+            the server thread. """
+        now = time.monotonic()
+
+        if now - self._last_idle_check < 1:
+            return
+
+        self._last_idle_check = now
+
+        for key in list(self._selector.get_map().values()):
+            if key.data and now - key.data[1] > KEEP_ALIVE_TIMEOUT:
+                self._selector.unregister(key.fileobj)
+                self._close(key.data[0])
+
+    def _handle_connection(self, handler):
+        """ Handles the waiting requests of a connection, then parks it,
+            streams to it from a new thread or closes it. """
+        try:
+            while True:
+                handler.close_connection = True
+                handler.handle_one_request()
+
+                if handler.close_connection or handler.stream_client or \
+                   not _request_waiting(handler):
+                    break
+
+        except Exception:  # pylint: disable=broad-except
+            self.handle_error(handler.request, handler.client_address)
+
+            handler.close_connection = True
+
+        if handler.stream_client:
+            threading.Thread(
+                target=self._stream, args=(handler,), daemon=True).start()
+
+        elif handler.close_connection:
+            self._close(handler)
+
+        else:
+            self._to_park.append(handler)
+
+            try:
+                self._wakeup_write.send(b"\0")
+
+            except BlockingIOError:
+                # Server thread has enough wake up calls waiting
+                pass
+
+    def _stream(self, handler):
+        """ Writes an event stream to its connection and closes it. """
+        try:
+            handler.stream_events()
+
+        finally:
+            self._close(handler)
+
+    def _close(self, handler):
+        """ Finishes the handler and closes its connection. """
+        try:
+            handler.finish()
+
+        finally:
+            self.shutdown_request(handler.request)
+
+
+def _request_waiting(handler):
+    """ Returns if the client of handler already sent (part of) its next
+    request, without waiting for it. """
+    connection = handler.connection
+    timeout = connection.gettimeout()
+
+    # Read whatever is available without blocking
+    connection.settimeout(0)
+
+    try:
+        return bool(handler.rfile.peek(1))
+
+    except OSError:
+        # Let handle_one_request find out what is wrong
+        return True
+
+    finally:
+        connection.settimeout(timeout)
+
+
+class StateJSONCache(object):
+    """ Caches the JSON of states for the API.
+
+    States are immutable and replaced on every change, so a cached fragment
+    is valid as long as it belongs to the same State object. The body with
+    all states is cached until the sequence number of the state machine
+    changes.
+
+    The ETags are weak so that they are the same for the compressed and
+    the uncompressed response, with or without a body. """
+
+    def __init__(self, hass):
+        self.hass = hass
+
+        # Maps entity id to (state, JSON fragment, ETag)
+        self._fragments = {}
+
+        # (ETag, body) of all states
+        self._all = (None, b"")
+
+    def all_etag(self):
+        """ Returns the ETag for the current states without serializing. """
+        # Sequence numbers start over after a restart, the run id tells
+        # the ETags of different runs apart
+        return 'W/"{}-{}"'.format(self.hass.states.run_id,
+                                  self.hass.states.sequence)
+
+    def all_states(self):
+        """ Returns (ETag, JSON body) for all states. """
+        # Get the ETag before the states, a change in between gives the next
+        # request a new ETag instead of serving stale states
+        etag = self.all_etag()
+
+        cached_etag, body = self._all
+
+        if cached_etag == etag:
+            return etag, body
+
+        fragments = {}
+
+        for entity_id, state in self.hass.states.all().items():
+            fragments[entity_id] = self._fragment(state)
+
+        # Replacing the dict drops the fragments of removed entities
+        self._fragments = fragments
+
+        body = b"{" + b",".join(
+            json.dumps(entity_id).encode("UTF-8") + b":" + fragment
+            for entity_id, (_, fragment, _) in sorted(fragments.items())) + \
+            b"}"
+
+        self._all = (etag, body)
+
+        return etag, body
+
+    def state(self, state):
+        """ Returns (ETag, JSON body) for a State. """
+        _, fragment, etag = self._fragment(state)
+
+        return etag, fragment
+
+    def _fragment(self, state):
+        """ Returns (state, JSON fragment, ETag) for a State. """
+        cached = self._fragments.get(state.entity_id)
+
+        if cached is None or cached[0] is not state:
+            fragment = json.dumps(
+                state, sort_keys=True, separators=JSON_SEPARATORS,
+                cls=rem.JSONEncoder).encode("UTF-8")
+
+            cached = self._fragments[state.entity_id] = (
+                state, fragment,
+                'W/"{}"'.format(hashlib.sha1(fragment).hexdigest()[:16]))
+
+        return cached
+
+
+class EventStreamClient(object):
+    """ Buffers the encoded events for a single stream.
+
+    The buffer holds at most max_size events. A client that falls further
+    behind is marked as dropped so that it cannot hold up the bus. """
+
+    def __init__(self, event_types=None, entity_ids=None,
+                 max_size=STREAM_QUEUE_SIZE):
+        self.event_types = event_types
+        self.entity_ids = entity_ids
+        self.max_size = max_size
+        self.dropped = False
+
+        # Called after an event is added, from the thread adding it
+        self.wakeup = None
+
+        self._events = collections.deque()
+        self._condition = threading.Condition()
+
+    def matches(self, event):
+        """ Returns if the client wants to receive event. """
+        return ((self.event_types is None or
+                 event.event_type in self.event_types) and
+                (self.entity_ids is None or
+                 event.data.get(ha.ATTR_ENTITY_ID) in self.entity_ids))
+
+    def put(self, message):
+        """ Adds an encoded event. Returns False if the client was dropped
+            because its buffer is full. """
+        with self._condition:
+            if len(self._events) >= self.max_size:
+                self.dropped = True
+            else:
+                self._events.append(message)
+
+            self._condition.notify()
+
+        if self.wakeup:
+            self.wakeup()
+
+        return not self.dropped
+
+    def get(self, timeout=None):
+        """ Returns a list of all buffered events. Waits up to timeout
+            seconds for events if there are none. """
+        with self._condition:
+            if not self._events and not self.dropped:
+                self._condition.wait(timeout)
+
+            return self.drain()
+
+    def drain(self):
+        """ Returns a list of all buffered events without waiting. """
+        events = []
+
+        while self._events:
+            events.append(self._events.popleft())
+
+        return events
+
+
+class EventStream(object):
+    """ Sends the events fired on the bus to the stream clients.
+
+    Listens to the bus only while there are clients. Every event is encoded
+    once, no matter how many clients receive it. """
+
+    def __init__(self, hass):
+        self.hass = hass
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        # Replaced on change so the listener can iterate it without a lock
+        self._clients = ()
+
+    def subscribe(self, event_types=None, entity_ids=None):
+        """ Returns a new EventStreamClient that receives the events. """
+        client = EventStreamClient(event_types, entity_ids)
+
+        with self._lock:
+            if not self._clients:
+                self.hass.bus.listen(ha.MATCH_ALL, self._event_listener)
+
+            self._clients += (client,)
+
+        return client
+
+    def unsubscribe(self, client):
+        """ Stops sending events to client. """
+        with self._lock:
+            if client not in self._clients:
+                return
+
+            self._clients = tuple(
+                other for other in self._clients if other is not client)
+
+            if not self._clients:
+                self.hass.bus.remove_listener(
+                    ha.MATCH_ALL, self._event_listener)
+
+    def _event_listener(self, event):
+        """ Adds event to the buffers of the clients that want it. """
+        message = None
+
+        for client in self._clients:
+            if not client.matches(event):
+                continue
+
+            if message is None:
+                message = "data: {}\n\n".format(json.dumps(
+                    {'event_type': event.event_type,
+                     'data': event.data,
+                     'origin': event.origin.value},
+                    sort_keys=True, cls=rem.JSONEncoder)).encode("UTF-8")
+
+            if not client.put(message):
+                self.logger.warning("Dropped a slow event stream client")
+
+                self.unsubscribe(client)
+
+
+class AsyncioHTTPServer(object):
+    """ Serves the same requests as HomeAssistantHTTPServer from an asyncio
+    event loop.
+
+    Connections are coroutines on the loop, so idle persistent connections
+    only cost a bit of memory. Complete requests are read on the loop and
+    handled by a BufferedRequestHandler in the loop's executor because the
+    handlers block.
+
+    Uses the loop of the core if it runs on asyncio, otherwise runs its own
+    loop in the thread calling start. """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, server_address, RequestHandlerClass,
+                 hass, api_password):
+        self.server_address = server_address
+        self.RequestHandlerClass = RequestHandlerClass
+        self.hass = hass
+        self.api_password = api_password
+        self.logger = logging.getLogger(__name__)
+
+        self.loop = getattr(hass, 'loop', None)
+
+        # To store flash messages between sessions
+        self.flash_message = None
+
+        # We will lazy init this one if needed
+        self.event_forwarder = None
+
+        # Set by setup if the history component is used
+        self.history = None
+
+        self.compression_level = COMPRESS_LEVEL
+
+        self.event_stream = EventStream(hass)
+
+        self.state_json = StateJSONCache(hass)
+
+    def start(self):
+        """ Starts the server. """
+        self.logger.info("Starting")
+
+        host, port = self.server_address
+
+        serve = asyncio.start_server(self._handle_connection, host, port)
+
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+
+            self.loop.run_until_complete(serve)
+            self.loop.run_forever()
+
+        else:
+            asyncio.run_coroutine_threadsafe(serve, self.loop).result()
+
+    async def _handle_connection(self, reader, writer):
+        """ Serves the requests of a connection till it is closed. """
+        client_address = writer.get_extra_info('peername')
+
+        try:
+            close_connection = False
+
+            while not close_connection:
+                try:
+                    request = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"),
+                        ASYNC_KEEP_ALIVE_TIMEOUT)
+
+                    # Read the body so the handler finds the whole request
+                    content_length = RE_CONTENT_LENGTH.search(request)
+
+                    if content_length:
+                        request += await reader.readexactly(
+                            int(content_length.group(1)))
+
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                        asyncio.LimitOverrunError, ConnectionError):
+                    # Idle for too long, closed by client or invalid request
+                    break
+
+                handler = await self.loop.run_in_executor(
+                    None, self.RequestHandlerClass,
+                    request, client_address, self)
+
+                writer.write(handler.wfile.getvalue())
+                await writer.drain()
+
+                if handler.stream_client:
+                    await self._stream_events(handler.stream_client, writer)
+
+                close_connection = handler.close_connection
+
+        except ConnectionError:
+            # Client went away while we were writing
+            pass
+
+        finally:
+            writer.close()
+
+    async def _stream_events(self, client, writer):
+        """ Writes the events of a stream client till it is dropped or the
+            connection is closed. """
+        ready = asyncio.Event()
+
+        client.wakeup = lambda: self.loop.call_soon_threadsafe(ready.set)
+
+        try:
+            while not client.dropped:
+                # Clear before draining so no wake up can get lost
+                ready.clear()
+
+                events = client.drain()
+
+                if events:
+                    writer.write(b"".join(events))
+                    await writer.drain()
+                    continue
+
+                try:
+                    await asyncio.wait_for(ready.wait(), STREAM_PING_INTERVAL)
+
+                except asyncio.TimeoutError:
+                    writer.write(b": ping\n\n")
+                    await writer.drain()
+
+        finally:
+            self.event_stream.unsubscribe(client)
+
+
+@functools.lru_cache(maxsize=4)
+def _root_page_parts(api_password):
+    """ Returns a dict with the encoded parts of the debug interface that do
+        not change between requests. """
+    parts = {
+        'head': (
+            "<html>"
+            "<head><title>Home Assistant</title>"
+            "<link rel='stylesheet' type='text/css' "
+            "      href='/static/style.css'>"
+            "<link rel='icon' href='/static/favicon.ico' "
+            "      type='image/x-icon' />"
+            "</head>"
+            "<body>"
+            "<div class='container'>"
+            "<div class='page-header'><h1>Home Assistant</h1></div>"),
+
+        'states_head': (
+            "<div class='row'>"
+            "<div class='col-xs-12'>"
+            "<div class='panel panel-primary'>"
+            "<div class='panel-heading'><h2 class='panel-title'>"
+            "     States</h2></div>"
+            "<form method='post' action='/change_state' "
+            "     class='form-change-state'>"
+            "<input type='hidden' name='api_password' value='{}'>"
+            "<table class='table'><tr>"
+            "<th>Entity ID</th><th>State</th>"
+            "<th>Attributes</th><th>Last Changed</th>"
+            "</tr>").format(api_password),
+
+        # Change state form
+        'states_form': (
+            "<tr><td><input name='entity_id' class='form-control' "
+            "  placeholder='Entity ID'></td>"
+            "<td><input name='new_state' class='form-control' "
+            "  placeholder='New State'></td>"
+            "<td><textarea rows='3' name='attributes' class='form-control' "
+            "  placeholder='State Attributes (JSON, optional)'>"
+            "</textarea></td>"
+            "<td><button type='submit' class='btn btn-default'>"
+            "Set State</button></td></tr>"
+
+            "</table></form>"),
+
+        'states_foot': "</div></div></div>",
+
+        'services_head': (
+            "<div class='row'>"
+            "<div class='col-xs-6'>"
+            "<div class='panel panel-primary'>"
+            "<div class='panel-heading'><h2 class='panel-title'>"
+            "     Services</h2></div>"
+            "<table class='table'>"
+            "<tr><th>Domain</th><th>Service</th></tr>"),
+
+        'services_foot': (
+            "</table></div></div>"
+
+            "<div class='col-xs-6'>"
+            "<div class='panel panel-primary'>"
+            "<div class='panel-heading'><h2 class='panel-title'>"
+            "     Call Service</h2></div>"
+            "<div class='panel-body'>"
+            "<form method='post' action='/call_service' "
+            "     class='form-horizontal form-fire-event'>"
+            "<input type='hidden' name='api_password' value='{}'>"
+
+            "<div class='form-group'>"
+            "  <label for='domain' class='col-xs-3 control-label'>"
+            "     Domain</label>"
+            "  <div class='col-xs-9'>"
+            "     <input type='text' class='form-control' id='domain'"
+            "       name='domain' placeholder='Service Domain'>"
+            "  </div>"
+            "</div>"
+
+            "<div class='form-group'>"
+            "  <label for='service' class='col-xs-3 control-label'>"
+            "     Service</label>"
+            "  <div class='col-xs-9'>"
+            "    <input type='text' class='form-control' id='service'"
+            "      name='service' placeholder='Service name'>"
+            "  </div>"
+            "</div>"
+
+            "<div class='form-group'>"
+            "  <label for='service_data' class='col-xs-3 control-label'>"
+            "    Service data</label>"
+            "  <div class='col-xs-9'>"
+            "    <textarea rows='3' class='form-control' id='service_data'"
+            "      name='service_data' placeholder='Service Data "
+            "(JSON, optional)'></textarea>"
+            "  </div>"
+            "</div>"
+
+            "<div class='form-group'>"
+            "  <div class='col-xs-offset-3 col-xs-9'>"
+            "    <button type='submit' class='btn btn-default'>"
+            "    Call Service</button>"
+            "  </div>"
+            "</div>"
+            "</form>"
+            "</div></div></div>"
+            "</div>").format(api_password),
+
+        'events_head': (
+            "<div class='row'>"
+            "<div class='col-xs-6'>"
+            "<div class='panel panel-primary'>"
+            "<div class='panel-heading'><h2 class='panel-title'>"
+            "     Events</h2></div>"
+            "<table class='table'>"
+            "<tr><th>Event</th><th>Listeners</th></tr>"),
+
+        'events_foot': (
+            "</table></div></div>"
+
+            "<div class='col-xs-6'>"
+            "<div class='panel panel-primary'>"
+            "<div class='panel-heading'><h2 class='panel-title'>"
+            "     Fire Event</h2></div>"
+            "<div class='panel-body'>"
+            "<form method='post' action='/fire_event' "
+            "     class='form-horizontal form-fire-event'>"
+            "<input type='hidden' name='api_password' value='{}'>"
+
+            "<div class='form-group'>"
+            "  <label for='event_type' class='col-xs-3 control-label'>"
+            "     Event type</label>"
+            "  <div class='col-xs-9'>"
+            "     <input type='text' class='form-control' id='event_type'"
+            "      name='event_type' placeholder='Event Type'>"
+            "  </div>"
+            "</div>"
+
+            "<div class='form-group'>"
+            "  <label for='event_data' class='col-xs-3 control-label'>"
+            "     Event data</label>"
+            "  <div class='col-xs-9'>"
+            "     <textarea rows='3' class='form-control' id='event_data'"
+            "      name='event_data' placeholder='Event Data "
+            "(JSON, optional)'></textarea>"
+            "  </div>"
+            "</div>"
+
+            "<div class='form-group'>"
+            "   <div class='col-xs-offset-3 col-xs-9'>"
+            "     <button type='submit' class='btn btn-default'>"
+            "     Fire Event</button>"
+            "   </div>"
+            "</div>"
+            "</form>"
+            "</div></div></div>"
+            "</div>"
+
+            "</div></body></html>").format(api_password),
+    }
+
+    return {key: part.encode("UTF-8") for key, part in parts.items()}
+
+
+def _compressor(encoding, level):
+    """ Returns a zlib compress object for content encoding gzip or
+    deflate. """
+    return zlib.compressobj(level, zlib.DEFLATED, COMPRESS_WBITS[encoding])
+
+
+def _compress(body, encoding, level):
+    """ Compresses body for content encoding gzip or deflate. """
+    compressor = _compressor(encoding, level)
+
+    return compressor.compress(body) + compressor.flush()
+
+
+# Bodies with an ETag do not change, remember their compressed versions
+_compress_cached = functools.lru_cache(maxsize=16)(_compress)
+
+
+def _decode_event_data(event_type, event_data):
+    """ Converts the state dicts in the data of a state_changed event that
+    was received as JSON back to State objects. """
+    if event_type == ha.EVENT_STATE_CHANGED and event_data:
+        for key in ('old_state', 'new_state'):
+            state = ha.State.from_dict(event_data.get(key))
+
+            if state:
+                event_data[key] = state
+
+    return event_data
+
+
+def _strip_weak(etag):
+    """ Returns the ETag without the weak indicator. """
+    etag = etag.strip()
+
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+class ChunkedWriter(object):
+    """ Collects small writes and sends them as chunks of a response with
+    chunked transfer encoding. Writes them as is if chunked is False.
+
+    If a zlib compressor is given the data is compressed with it. """
+
+    def __init__(self, wfile, chunked=True, chunk_size=CHUNK_SIZE,
+                 compressor=None):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.chunk_size = chunk_size
+        self.compressor = compressor
+
+        self._buffer = []
+        self._size = 0
+
+    def write(self, data):
+        """ Buffers data, sends a chunk when the buffer is full. """
+        self._buffer.append(data)
+        self._size += len(data)
+
+        if self._size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """ Sends the buffered data as a chunk. """
+        if not self._size:
+            return
+
+        data = b"".join(self._buffer)
+
+        self._buffer = []
+        self._size = 0
+
+        if self.compressor:
+            data = self.compressor.compress(data)
+
+        self._write(data)
+
+    def close(self):
+        """ Sends the buffered data and ends the response. """
+        self.flush()
+
+        if self.compressor:
+            self._write(self.compressor.flush())
+
+        if self.chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _write(self, data):
+        """ Writes data as a chunk. """
+        # An empty chunk would end the response
+        if not data:
+            return
+
+        if self.chunked:
+            self.wfile.write(
+                "{:x}\r\n".format(len(data)).encode("ASCII") + data + b"\r\n")
+        else:
+            self.wfile.write(data)
 
 
 # pylint: disable=too-many-public-methods
 class RequestHandler(BaseHTTPRequestHandler):
     """ Handles incoming HTTP requests """
 
+    # Keep connections alive, requires a Content-Length on every response
+    protocol_version = "HTTP/1.1"
+
+    # Seconds to wait for a request that started to arrive completely
+    timeout = KEEP_ALIVE_TIMEOUT
+
+    # Set by _handle_get_api_stream, the server writes the events to it
+    stream_client = None
+
+    # Headers and body are written separately. With Nagle's algorithm the
+    # body would wait for the client to acknowledge the headers.
+    disable_nagle_algorithm = True
+
     PATHS = [  # debug interface
         ('GET', URL_ROOT, '_handle_get_root'),
         # These get compiled as RE because these methods are reused
@@ -165,6 +1180,7 @@ class RequestHandler(BaseHTTPRequestHandler):
 
         # /states
         ('GET', rem.URL_API_STATES, '_handle_get_api_states'),
+        ('POST', rem.URL_API_STATES, '_handle_post_api_states'),
         ('GET',
          re.compile(r'/api/states/(?P<entity_id>[a-zA-Z\._0-9]+)'),
          '_handle_get_api_states_entity'),
@@ -172,8 +1188,25 @@ class RequestHandler(BaseHTTPRequestHandler):
          re.compile(r'/api/states/(?P<entity_id>[a-zA-Z\._0-9]+)'),
          '_handle_change_state'),
 
+        # /changes
+        ('GET', rem.URL_API_CHANGES, '_handle_get_api_changes'),
+
+        # /history, compiled as RE for the same reason as above
+        ('GET', re.compile(rem.URL_API_HISTORY + '$'),
+         '_handle_get_api_history'),
+        ('GET',
+         re.compile(r'/api/history/(?P<entity_id>[a-zA-Z\._0-9]+)'),
+         '_handle_get_api_history'),
+
+        # /stream
+        ('GET', rem.URL_API_STREAM, '_handle_get_api_stream'),
+
+        # /stats
+        ('GET', rem.URL_API_STATS, '_handle_get_api_stats'),
+
         # /events
         ('GET', rem.URL_API_EVENTS, '_handle_get_api_events'),
+        ('POST', rem.URL_API_EVENTS, '_handle_post_api_events'),
         ('POST',
          re.compile(r'/api/events/(?P<event_type>[a-zA-Z\._0-9]+)'),
          '_handle_fire_event'),
@@ -196,6 +1229,8 @@ class RequestHandler(BaseHTTPRequestHandler):
          '_handle_get_static')
     ]
 
+    ROUTER = Router(PATHS)
+
     use_json = False
 
     def _handle_request(self, method):  # pylint: disable=too-many-branches
@@ -220,36 +1255,15 @@ class RequestHandler(BaseHTTPRequestHandler):
         if '_METHOD' in data:
             method = data['_METHOD'][0]
 
-        if url.path.startswith('/api/'):
-            self.use_json = True
-
-        # Var to keep track if we found a path that matched a handler but
-        # the method was different
-        path_matched_but_not_method = False
-
-        # Var to hold the handler for this path and method if found
-        handle_request_method = False
-
-        # Check every handler to find matching result
-        for t_method, t_path, t_handler in RequestHandler.PATHS:
-
-            # we either do string-comparison or regular expression matching
-            # pylint: disable=maybe-no-member
-            if isinstance(t_path, str):
-                path_match = url.path == t_path
-            else:
-                path_match = t_path.match(url.path)
+        # Set for every request, one handler serves all requests of a
+        # persistent connection
+        self.use_json = url.path.startswith('/api/')
 
-            if path_match and method == t_method:
-                # Call the method
-                handle_request_method = getattr(self, t_handler)
-                break
-
-            elif path_match:
-                path_matched_but_not_method = True
+        t_handler, path_match = RequestHandler.ROUTER.match(method, url.path)
 
         # Did we find a handler for the incoming request?
-        if handle_request_method:
+        if t_handler:
+            handle_request_method = getattr(self, t_handler)
 
             # Do not enforce api password for static files
             if handle_request_method == self._handle_get_static or \
@@ -257,11 +1271,12 @@ class RequestHandler(BaseHTTPRequestHandler):
 
                 handle_request_method(path_match, data)
 
-        elif path_matched_but_not_method:
-            self.send_response(HTTP_METHOD_NOT_ALLOWED)
+        elif t_handler is False:
+            # Path matched a handler but the method was different
+            self._write_response(HTTP_METHOD_NOT_ALLOWED)
 
         else:
-            self.send_response(HTTP_NOT_FOUND)
+            self._write_response(HTTP_NOT_FOUND)
 
     def do_GET(self):  # pylint: disable=invalid-name
         """ GET request handler. """
@@ -282,11 +1297,7 @@ class RequestHandler(BaseHTTPRequestHandler):
                 "API password missing or incorrect.", HTTP_UNAUTHORIZED)
 
         else:
-            self.send_response(HTTP_OK)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-
-            self.wfile.write((
+            self._write_response(HTTP_OK, 'text/html', (
                 "<html>"
                 "<head><title>Home Assistant</title>"
                 "<link rel='stylesheet' type='text/css' "
@@ -313,196 +1324,110 @@ class RequestHandler(BaseHTTPRequestHandler):
 
     # pylint: disable=unused-argument
     def _handle_get_root(self, path_match, data):
-        """ Renders the debug interface. """
+        """ Renders the debug interface.
 
-        write = lambda txt: self.wfile.write((txt + "\n").encode("UTF-8"))
+        optional parameter: domain - only show the states of this domain
+        optional parameter: page - page of the states table to show
+        """
+        parts = _root_page_parts(self.server.api_password)
 
-        self.send_response(HTTP_OK)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
+        domain = data['domain'][0] if 'domain' in data else None
+        page = util.convert(data['page'][0], int, 1) if 'page' in data else 1
 
-        write(("<html>"
-               "<head><title>Home Assistant</title>"
-               "<link rel='stylesheet' type='text/css' "
-               "      href='/static/style.css'>"
-               "<link rel='icon' href='/static/favicon.ico' "
-               "      type='image/x-icon' />"
-               "</head>"
-               "<body>"
-               "<div class='container'>"
-               "<div class='page-header'><h1>Home Assistant</h1></div>"))
+        writer = self._write_chunked_headers(
+            HTTP_OK, 'text/html; charset=utf-8')
+
+        writer.write(parts['head'])
 
         # Flash message support
         if self.server.flash_message:
-            write(("<div class='row'><div class='col-xs-12'>"
-                   "<div class='alert alert-success'>"
-                   "{}</div></div></div>").format(self.server.flash_message))
+            writer.write((
+                "<div class='row'><div class='col-xs-12'>"
+                "<div class='alert alert-success'>"
+                "{}</div></div></div>").format(
+                    self.server.flash_message).encode("UTF-8"))
 
             self.server.flash_message = None
 
         # Describe state machine:
-        write(("<div class='row'>"
-               "<div class='col-xs-12'>"
-               "<div class='panel panel-primary'>"
-               "<div class='panel-heading'><h2 class='panel-title'>"
-               "     States</h2></div>"
-               "<form method='post' action='/change_state' "
-               "     class='form-change-state'>"
-               "<input type='hidden' name='api_password' value='{}'>"
-               "<table class='table'><tr>"
-               "<th>Entity ID</th><th>State</th>"
-               "<th>Attributes</th><th>Last Changed</th>"
-               "</tr>").format(self.server.api_password))
-
-        for entity_id, state in \
-            sorted(self.server.hass.states.all().items(),
-                   key=lambda item: item[0].lower()):
+        all_states = self.server.hass.states.all()
 
-            attributes = "<br>".join(
-                ["{}: {}".format(attr, state.attributes[attr])
-                 for attr in state.attributes])
+        entity_ids = sorted(
+            (entity_id for entity_id in all_states
+             if domain is None or entity_id.startswith(domain + ".")),
+            key=str.lower)
 
-            write(("<tr>"
-                   "<td>{}</td><td>{}</td><td>{}</td><td>{}</td>"
-                   "</tr>").format(
-                  entity_id,
-                  state.state,
-                  attributes,
-                  util.datetime_to_str(state.last_changed)))
+        page_count = max(1, -(-len(entity_ids) // STATES_PER_PAGE))
+        page = min(max(page, 1), page_count)
+        first = (page - 1) * STATES_PER_PAGE
 
-        # Change state form
-        write(("<tr><td><input name='entity_id' class='form-control' "
-               "  placeholder='Entity ID'></td>"
-               "<td><input name='new_state' class='form-control' "
-               "  placeholder='New State'></td>"
-               "<td><textarea rows='3' name='attributes' class='form-control' "
-               "  placeholder='State Attributes (JSON, optional)'>"
-               "</textarea></td>"
-               "<td><button type='submit' class='btn btn-default'>"
-               "Set State</button></td></tr>"
+        writer.write(parts['states_head'])
 
-               "</table></form></div>"
+        for entity_id in entity_ids[first:first + STATES_PER_PAGE]:
+            state = all_states[entity_id]
 
-               "</div></div>"))
+            attributes = "<br>".join(
+                ["{}: {}".format(attr, state.attributes[attr])
+                 for attr in state.attributes])
+
+            writer.write((
+                "<tr>"
+                "<td>{}</td><td>{}</td><td>{}</td><td>{}</td>"
+                "</tr>").format(
+                    entity_id,
+                    state.state,
+                    attributes,
+                    util.datetime_to_str(state.last_changed)).encode("UTF-8"))
+
+        writer.write(parts['states_form'])
+
+        # Filter by domain and page through the states
+        def link(text, link_domain, link_page):
+            """ Returns a link to a page of the states of link_domain. """
+            return "<a href='/?{}'>{}</a>".format(urlencode(dict(
+                api_password=self.server.api_password,
+                page=link_page,
+                **({'domain': link_domain} if link_domain else {}))), text)
+
+        domains = sorted(set(
+            util.split_entity_id(entity_id)[0] for entity_id in all_states))
+
+        writer.write((
+            "<div class='panel-footer'>"
+            "<p>Domain: {}</p>"
+            "<p>Page {} of {} {} {}</p>"
+            "</div>").format(
+                " ".join([link("all", None, 1)] +
+                         [link(link_domain, link_domain, 1)
+                          for link_domain in domains]),
+                page, page_count,
+                link("previous", domain, page - 1) if page > 1 else "",
+                link("next", domain, page + 1)
+                if page < page_count else "").encode("UTF-8"))
+
+        writer.write(parts['states_foot'])
 
         # Describe bus/services:
-        write(("<div class='row'>"
-               "<div class='col-xs-6'>"
-               "<div class='panel panel-primary'>"
-               "<div class='panel-heading'><h2 class='panel-title'>"
-               "     Services</h2></div>"
-               "<table class='table'>"
-               "<tr><th>Domain</th><th>Service</th></tr>"))
-
-        for domain, services in sorted(
+        writer.write(parts['services_head'])
+
+        for service_domain, services in sorted(
                 self.server.hass.services.services.items()):
-            write("<tr><td>{}</td><td>{}</td></tr>".format(
-                domain, ", ".join(services)))
-
-        write(("</table></div></div>"
-
-               "<div class='col-xs-6'>"
-               "<div class='panel panel-primary'>"
-               "<div class='panel-heading'><h2 class='panel-title'>"
-               "     Call Service</h2></div>"
-               "<div class='panel-body'>"
-               "<form method='post' action='/call_service' "
-               "     class='form-horizontal form-fire-event'>"
-               "<input type='hidden' name='api_password' value='{}'>"
-
-               "<div class='form-group'>"
-               "  <label for='domain' class='col-xs-3 control-label'>"
-               "     Domain</label>"
-               "  <div class='col-xs-9'>"
-               "     <input type='text' class='form-control' id='domain'"
-               "       name='domain' placeholder='Service Domain'>"
-               "  </div>"
-               "</div>"
-
-               "<div class='form-group'>"
-               "  <label for='service' class='col-xs-3 control-label'>"
-               "     Service</label>"
-               "  <div class='col-xs-9'>"
-               "    <input type='text' class='form-control' id='service'"
-               "      name='service' placeholder='Service name'>"
-               "  </div>"
-               "</div>"
-
-               "<div class='form-group'>"
-               "  <label for='service_data' class='col-xs-3 control-label'>"
-               "    Service data</label>"
-               "  <div class='col-xs-9'>"
-               "    <textarea rows='3' class='form-control' id='service_data'"
-               "      name='service_data' placeholder='Service Data "
-               "(JSON, optional)'></textarea>"
-               "  </div>"
-               "</div>"
-
-               "<div class='form-group'>"
-               "  <div class='col-xs-offset-3 col-xs-9'>"
-               "    <button type='submit' class='btn btn-default'>"
-               "    Call Service</button>"
-               "  </div>"
-               "</div>"
-               "</form>"
-               "</div></div></div>"
-               "</div>").format(self.server.api_password))
+            writer.write("<tr><td>{}</td><td>{}</td></tr>".format(
+                service_domain, ", ".join(services)).encode("UTF-8"))
+
+        writer.write(parts['services_foot'])
 
         # Describe bus/events:
-        write(("<div class='row'>"
-               "<div class='col-xs-6'>"
-               "<div class='panel panel-primary'>"
-               "<div class='panel-heading'><h2 class='panel-title'>"
-               "     Events</h2></div>"
-               "<table class='table'>"
-               "<tr><th>Event</th><th>Listeners</th></tr>"))
+        writer.write(parts['events_head'])
 
         for event, listener_count in sorted(
                 self.server.hass.bus.listeners.items()):
-            write("<tr><td>{}</td><td>{}</td></tr>".format(
-                event, listener_count))
-
-        write(("</table></div></div>"
-
-               "<div class='col-xs-6'>"
-               "<div class='panel panel-primary'>"
-               "<div class='panel-heading'><h2 class='panel-title'>"
-               "     Fire Event</h2></div>"
-               "<div class='panel-body'>"
-               "<form method='post' action='/fire_event' "
-               "     class='form-horizontal form-fire-event'>"
-               "<input type='hidden' name='api_password' value='{}'>"
-
-               "<div class='form-group'>"
-               "  <label for='event_type' class='col-xs-3 control-label'>"
-               "     Event type</label>"
-               "  <div class='col-xs-9'>"
-               "     <input type='text' class='form-control' id='event_type'"
-               "      name='event_type' placeholder='Event Type'>"
-               "  </div>"
-               "</div>"
-
-               "<div class='form-group'>"
-               "  <label for='event_data' class='col-xs-3 control-label'>"
-               "     Event data</label>"
-               "  <div class='col-xs-9'>"
-               "     <textarea rows='3' class='form-control' id='event_data'"
-               "      name='event_data' placeholder='Event Data "
-               "(JSON, optional)'></textarea>"
-               "  </div>"
-               "</div>"
-
-               "<div class='form-group'>"
-               "   <div class='col-xs-offset-3 col-xs-9'>"
-               "     <button type='submit' class='btn btn-default'>"
-               "     Fire Event</button>"
-               "   </div>"
-               "</div>"
-               "</form>"
-               "</div></div></div>"
-               "</div>").format(self.server.api_password))
-
-        write("</div></body></html>")
+            writer.write("<tr><td>{}</td><td>{}</td></tr>".format(
+                event, listener_count).encode("UTF-8"))
+
+        writer.write(parts['events_foot'])
+
+        writer.close()
 
     # pylint: disable=invalid-name
     def _handle_change_state(self, path_match, data):
@@ -552,6 +1477,63 @@ class RequestHandler(BaseHTTPRequestHandler):
             self._message(
                 "Invalid JSON for attributes", HTTP_UNPROCESSABLE_ENTITY)
 
+    def _handle_post_api_states(self, path_match, data):
+        """ Handles updating the states of multiple entities at once.
+
+        Expects a JSON list of objects with an entity_id, a state and
+        optionally attributes. Valid items are set in one pass, the result
+        is a list with for each item the new state or an error message. """
+        try:
+            items = json.loads(data['states'][0])
+
+        except KeyError:
+            self._message("No states submitted.", HTTP_BAD_REQUEST)
+            return
+
+        except ValueError:
+            self._message("Invalid JSON for states", HTTP_UNPROCESSABLE_ENTITY)
+            return
+
+        if not isinstance(items, list):
+            self._message("States should be a list", HTTP_UNPROCESSABLE_ENTITY)
+            return
+
+        states = []
+        results = []
+
+        for item in items:
+            try:
+                entity_id = item['entity_id']
+                new_state = item['state']
+                attributes = item.get('attributes')
+
+            except (KeyError, TypeError, AttributeError):
+                # Item is not a dict or lacks entity_id or state
+                results.append({'message': "No entity_id or state given."})
+                continue
+
+            if not isinstance(entity_id, str) or \
+               not RE_ENTITY_ID.fullmatch(entity_id):
+                results.append({'message': "Invalid entity_id"})
+
+            elif not isinstance(new_state, str):
+                results.append({'message': "State should be a string"})
+
+            elif not isinstance(attributes, (dict, type(None))):
+                results.append({'message': "Invalid attributes"})
+
+            else:
+                states.append((entity_id, new_state, attributes))
+                results.append(entity_id)
+
+        self.server.hass.states.set_multiple(states)
+
+        get_state = self.server.hass.states.get
+
+        self._write_json([
+            get_state(result) if isinstance(result, str) else result
+            for result in results])
+
     # pylint: disable=invalid-name
     def _handle_fire_event(self, path_match, data):
         """ Handles firing of an event.
@@ -576,16 +1558,9 @@ class RequestHandler(BaseHTTPRequestHandler):
             else:
                 event_data = None
 
-            # Special case handling for event STATE_CHANGED
-            # We will try to convert state dicts back to State objects
-            if event_type == ha.EVENT_STATE_CHANGED and event_data:
-                for key in ('old_state', 'new_state'):
-                    state = ha.State.from_dict(event_data.get(key))
-
-                    if state:
-                        event_data[key] = state
-
-            self.server.hass.bus.fire(event_type, event_data, event_origin)
+            self.server.hass.bus.fire(
+                event_type, _decode_event_data(event_type, event_data),
+                event_origin)
 
             self._message("Event {} fired.".format(event_type))
 
@@ -598,6 +1573,36 @@ class RequestHandler(BaseHTTPRequestHandler):
             self._message(
                 "Invalid JSON for event_data", HTTP_UNPROCESSABLE_ENTITY)
 
+    def _handle_post_api_events(self, path_match, data):
+        """ Handles firing multiple remote events at once.
+
+        Expects a JSON list of objects with an event_type and optionally
+        event_data. The events are fired in order. """
+        try:
+            items = json.loads(data['events'][0])
+
+            events = [(item['event_type'],
+                       _decode_event_data(item['event_type'],
+                                          item.get('event_data')))
+                      for item in items]
+
+        except KeyError:
+            self._message(
+                "No events or event_type received.", HTTP_BAD_REQUEST)
+            return
+
+        except (ValueError, TypeError, AttributeError):
+            # ValueError if the JSON could not be parsed, the others if it
+            # was not a list of dicts
+            self._message("Invalid JSON for events", HTTP_UNPROCESSABLE_ENTITY)
+            return
+
+        for event_type, event_data in events:
+            self.server.hass.bus.fire(
+                event_type, event_data, ha.EventOrigin.remote)
+
+        self._message("{} events fired.".format(len(events)))
+
     def _handle_call_service(self, path_match, data):
         """ Handles calling a service.
 
@@ -641,7 +1646,12 @@ class RequestHandler(BaseHTTPRequestHandler):
     # pylint: disable=unused-argument
     def _handle_get_api_states(self, path_match, data):
         """ Returns a dict containing all entity ids and their state. """
-        self._write_json(self.server.hass.states.all())
+        cache = self.server.state_json
+
+        if not self._not_modified(cache.all_etag()):
+            etag, body = cache.all_states()
+
+            self._write_response(HTTP_OK, 'application/json', body, etag=etag)
 
     # pylint: disable=unused-argument
     def _handle_get_api_states_entity(self, path_match, data):
@@ -651,10 +1661,160 @@ class RequestHandler(BaseHTTPRequestHandler):
         state = self.server.hass.states.get(entity_id)
 
         if state:
-            self._write_json(state)
+            etag, body = self.server.state_json.state(state)
+
+            if not self._not_modified(etag):
+                self._write_response(
+                    HTTP_OK, 'application/json', body, etag=etag)
         else:
             self._message("State does not exist.", HTTP_UNPROCESSABLE_ENTITY)
 
+    def _handle_get_api_changes(self, path_match, data):
+        """ Returns the states that changed since a sequence number or all
+            states if that is not possible. """
+        states = self.server.hass.states
+
+        try:
+            run_id, _, sequence = data['since'][0].rpartition('-')
+            sequence = int(sequence)
+
+            # Sequence numbers start over after a restart, a sequence of an
+            # earlier run would give a partial result that looks valid
+            changes = states.changes_since(sequence) \
+                if run_id == states.run_id else None
+
+        except KeyError:
+            # Happens if key 'since' does not exist
+            changes = None
+
+        except ValueError:
+            # Occurs during error parsing since
+            self._message(
+                "Invalid value received for since", HTTP_UNPROCESSABLE_ENTITY)
+            return
+
+        if changes:
+            sequence, changed_states = changes
+            complete = False
+
+        else:
+            # Get sequence before the states so a change in between will be
+            # sent again instead of getting lost
+            sequence = states.sequence
+            changed_states = states.all()
+            complete = True
+
+        self._write_json({'sequence': "{}-{}".format(states.run_id, sequence),
+                          'complete': complete,
+                          'states': changed_states})
+
+    def _handle_get_api_history(self, path_match, data):
+        """ Returns the states of entities over a period of time.
+
+        This handles the following paths:
+        /api/history
+        /api/history/<entity_id>
+        """
+        history = self.server.history
+
+        if history is None:
+            self._message("History is not enabled.", HTTP_NOT_FOUND)
+            return
+
+        try:
+            entity_ids = [path_match.group('entity_id')]
+        except IndexError:
+            # If group entity_id does not exist in path_match
+            entity_ids = data['entity_id'][0].split(",") \
+                if 'entity_id' in data else sorted(history.entity_ids)
+
+        try:
+            end = util.str_to_datetime(data['end'][0]) \
+                if 'end' in data else dt.datetime.now()
+
+            start = util.str_to_datetime(data['start'][0]) \
+                if 'start' in data else end - dt.timedelta(days=1)
+
+            buckets = int(data['buckets'][0]) if 'buckets' in data else None
+
+            if start is None or end is None or (buckets or 1) < 1:
+                raise ValueError()
+
+        except ValueError:
+            # Occurs during error parsing start, end or buckets
+            self._message("Invalid value received for start, end or buckets",
+                          HTTP_UNPROCESSABLE_ENTITY)
+            return
+
+        # Downsampling loops over the buckets, more of them than there are
+        # stored changes only costs time on the request thread
+        if buckets is not None and buckets > history.max_points:
+            self._message(
+                "At most {} buckets allowed".format(history.max_points),
+                HTTP_BAD_REQUEST)
+            return
+
+        writer = self._write_chunked_headers(HTTP_OK, 'application/json')
+
+        # Stream one entity at a time so only the points of a single entity
+        # are in memory at any moment
+        writer.write(b"{")
+
+        for number, entity_id in enumerate(entity_ids):
+            points = [
+                (util.datetime_to_str(dt.datetime.fromtimestamp(timestamp)),
+                 state) for timestamp, state
+                in history.get_points(entity_id, start, end, buckets)]
+
+            writer.write("{}{}:{}".format(
+                "," if number else "", json.dumps(entity_id),
+                json.dumps(points, separators=JSON_SEPARATORS)
+            ).encode("UTF-8"))
+
+        writer.write(b"}")
+        writer.close()
+
+    def _handle_get_api_stream(self, path_match, data):
+        """ Streams the events fired on the bus to the client. """
+        event_types, entity_ids = (
+            set(data[key][0].split(",")) if key in data else None
+            for key in ('event_type', 'entity_id'))
+
+        client = self.server.event_stream.subscribe(event_types, entity_ids)
+
+        self.send_response(HTTP_OK)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        # The stream ends by closing the connection
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        # Streaming is left to the server so it does not hold a worker
+        self.stream_client = client
+
+    def stream_events(self):
+        """ Writes the events of stream_client till it is dropped or the
+            connection is closed. """
+        client = self.stream_client
+
+        try:
+            while not client.dropped:
+                events = client.get(STREAM_PING_INTERVAL)
+
+                self.wfile.write(
+                    b"".join(events) if events else b": ping\n\n")
+
+        except (OSError, ValueError):
+            # Connection closed or timed out writing to a slow client
+            pass
+
+        finally:
+            self.server.event_stream.unsubscribe(client)
+
+    def _handle_get_api_stats(self, path_match, data):
+        """ Handles getting the metrics of the worker pool and scheduler. """
+        self._write_json(self.server.hass.stats)
+
     def _handle_get_api_events(self, path_match, data):
         """ Handles getting overview of event listeners. """
         self._write_json({'event_listeners': self.server.hass.bus.listeners})
@@ -718,29 +1878,173 @@ class RequestHandler(BaseHTTPRequestHandler):
                 "Invalid value received for port", HTTP_UNPROCESSABLE_ENTITY)
 
     def _handle_get_static(self, path_match, data):
-        """ Returns a static file. """
+        """ Returns a static file.
+
+        Serves a gzipped variant, the file name with .gz appended, to
+        clients accepting gzip if it exists. """
         req_file = util.sanitize_filename(path_match.group('file'))
 
-        path = os.path.join(os.path.dirname(__file__), 'www_static', req_file)
+        path = os.path.join(STATIC_DIR, req_file)
+
+        if not os.path.isfile(path):
+            self._write_response(HTTP_NOT_FOUND)
+            return
+
+        content_type = mimetypes.guess_type(path)[0] or \
+            'application/octet-stream'
+
+        content_encoding = None
+
+        if self._accepted_encoding(('gzip',)) and \
+           os.path.isfile(path + '.gz'):
+
+            path += '.gz'
+            content_encoding = 'gzip'
+
+        stat = os.stat(path)
+
+        etag = '"{:x}-{:x}{}"'.format(
+            int(stat.st_mtime), stat.st_size,
+            '-gz' if content_encoding else '')
+
+        if self._not_modified(etag, stat.st_mtime):
+            return
+
+        self.send_response(HTTP_OK)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(stat.st_size))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified',
+                         email.utils.formatdate(stat.st_mtime, usegmt=True))
+        self.send_header('Cache-Control',
+                         'public, max-age={}'.format(STATIC_MAX_AGE))
+        # Caches have to keep the gzipped and plain variants apart
+        self.send_header('Vary', 'Accept-Encoding')
+
+        if content_encoding:
+            self.send_header('Content-Encoding', content_encoding)
 
-        if os.path.isfile(path):
-            self.send_response(HTTP_OK)
+        self.end_headers()
 
-            # TODO: correct header for mime-type and caching
+        with open(path, 'rb') as inp:
+            self._write_file(inp)
 
-            self.end_headers()
+    def _write_file(self, inp):
+        """ Writes the contents of an open file to the client. Lets the
+            kernel copy it straight to the socket if possible. """
+        try:
+            self.connection.sendfile(inp)
 
-            with open(path, 'rb') as inp:
-                data = inp.read(1024)
+        except AttributeError:
+            # No socket, for example with a BufferedRequestHandler
+            shutil.copyfileobj(inp, self.wfile)
 
-                while data:
-                    self.wfile.write(data)
+    def _write_chunked_headers(self, status_code, content_type):
+        """ Sends the headers for a response of unknown length. Returns a
+            ChunkedWriter to write the body with. """
+        # HTTP/1.0 clients do not know chunks, close the connection instead
+        chunked = self.request_version != 'HTTP/1.0'
 
-                    data = inp.read(1024)
+        # The length is not known up front so always compress if we can
+        encoding = self._accepted_encoding()
 
+        self.send_response(status_code)
+        self.send_header('Content-type', content_type)
+
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
         else:
-            self.send_response(HTTP_NOT_FOUND)
-            self.end_headers()
+            self.send_header('Connection', 'close')
+
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Vary', 'Accept-Encoding')
+
+        self.end_headers()
+
+        return ChunkedWriter(
+            self.wfile, chunked, compressor=_compressor(
+                encoding, self.server.compression_level) if encoding else None)
+
+    def _accepted_encoding(self, encodings=None):
+        """ Returns the content encoding from encodings, by default those we
+            can compress with if compression is enabled, that the client
+            prefers according to its Accept-Encoding header or None if it
+            accepts none of them. """
+        if encodings is None:
+            encodings = COMPRESS_WBITS if self.server.compression_level \
+                else ()
+
+        accept_encoding = self.headers.get('Accept-Encoding')
+
+        if not accept_encoding:
+            return None
+
+        qualities = {}
+
+        for coding in accept_encoding.lower().split(","):
+            name, _, params = coding.partition(";")
+            quality = 1.0
+
+            for param in params.split(";"):
+                key, _, value = param.partition("=")
+
+                if key.strip() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+
+            qualities[name.strip()] = quality
+
+        # Encodings that are not listed get the quality of *
+        default = qualities.get('*', 0.0)
+
+        best, best_quality = None, 0.0
+
+        for encoding in encodings:
+            quality = qualities.get(encoding, default)
+
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+
+        return best
+
+    def _not_modified(self, etag, last_modified=None):
+        """ Sends 304 Not Modified and returns True if the client has the
+            version identified by etag or, if the client sent no ETag, the
+            version of timestamp last_modified. """
+        if_none_match = self.headers.get('If-None-Match')
+
+        if if_none_match:
+            # If-None-Match uses the weak comparison
+            if if_none_match.strip() != '*' and _strip_weak(etag) not in (
+                    _strip_weak(tag) for tag in if_none_match.split(",")):
+                return False
+
+        elif last_modified is None or \
+                not self._not_modified_since(last_modified):
+            return False
+
+        self.send_response(HTTP_NOT_MODIFIED)
+        self.send_header('ETag', etag)
+        self.end_headers()
+
+        return True
+
+    def _not_modified_since(self, last_modified):
+        """ Returns if the client sent an If-Modified-Since that is not
+            older than timestamp last_modified. """
+        try:
+            since = email.utils.parsedate_to_datetime(
+                self.headers.get('If-Modified-Since'))
+
+        except (TypeError, ValueError, IndexError):
+            # Header missing or invalid
+            return False
+
+        # Last-Modified has a resolution of seconds
+        return since.timestamp() >= int(last_modified)
 
     def _message(self, message, status_code=HTTP_OK):
         """ Helper method to return a message to the caller. """
@@ -754,25 +2058,73 @@ class RequestHandler(BaseHTTPRequestHandler):
 
     def _redirect(self, location):
         """ Helper method to redirect caller. """
-        self.send_response(HTTP_MOVED_PERMANENTLY)
-
-        self.send_header(
-            "Location", "{}?api_password={}".format(
+        self._write_response(
+            HTTP_MOVED_PERMANENTLY,
+            location="{}?api_password={}".format(
                 location, self.server.api_password))
 
-        self.end_headers()
-
     def _write_json(self, data=None, status_code=HTTP_OK, location=None):
         """ Helper method to return JSON to the caller. """
+        body = json.dumps(data, sort_keys=True, separators=JSON_SEPARATORS,
+                          cls=rem.JSONEncoder).encode("UTF-8") \
+            if data is not None else b""
+
+        self._write_response(status_code, 'application/json', body, location)
+
+    # pylint: disable=too-many-arguments
+    def _write_response(self, status_code, content_type=None, body=b"",
+                        location=None, etag=None):
+        """ Helper method to send a complete response. Always sends a
+            Content-Length so the connection can be kept alive.
+
+            Compresses bodies of at least COMPRESS_MIN_SIZE bytes if the
+            client accepts it. """
+        encoding = self._accepted_encoding() \
+            if len(body) >= COMPRESS_MIN_SIZE else None
+
+        if encoding:
+            level = self.server.compression_level
+
+            # Bodies with an ETag are served again, compress them once
+            if etag:
+                body = _compress_cached(body, encoding, level)
+            else:
+                body = _compress(body, encoding, level)
+
         self.send_response(status_code)
-        self.send_header('Content-type', 'application/json')
+
+        if content_type:
+            self.send_header('Content-type', content_type)
 
         if location:
             self.send_header('Location', location)
 
+        if etag:
+            self.send_header('ETag', etag)
+
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Vary', 'Accept-Encoding')
+
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
 
-        if data:
-            self.wfile.write(
-                json.dumps(data, indent=4, sort_keys=True,
-                           cls=rem.JSONEncoder).encode("UTF-8"))
+        if body:
+            self.wfile.write(body)
+
+
+class BufferedRequestHandler(RequestHandler):
+    """ RequestHandler that reads a complete request from bytes and writes
+    the response to a memory buffer instead of using a socket. """
+
+    def setup(self):
+        self.rfile = io.BytesIO(self.request)
+        self.wfile = io.BytesIO()
+
+    def handle(self):
+        self.close_connection = True
+
+        self.handle_one_request()
+
+    def finish(self):
+        pass
@@ -144,8 +144,9 @@ def setup(hass, light_control):
     ent_to_light = {}
     light_to_ent = {}
 
-    def _update_light_state(light_id, light_state):
-        """ Update statemachine based on the LightState passed in. """
+    def _light_state(light_id, light_state):
+        """ Returns (entity_id, state, attributes) tuple for the statemachine
+            based on the LightState passed in. """
         name = light_control.get_name(light_id) or "Unknown Light"
 
         try:
@@ -177,11 +178,11 @@ def setup(hass, light_control):
         else:
             state = STATE_OFF
 
-        hass.states.set(entity_id, state, state_attr)
+        return entity_id, state, state_attr
 
     def update_light_state(light_id):
         """ Update the state of specified light. """
-        _update_light_state(light_id, light_control.get(light_id))
+        hass.states.set(*_light_state(light_id, light_control.get(light_id)))
 
     # pylint: disable=unused-argument
     def update_lights_state(time, force_reload=False):
@@ -195,8 +196,9 @@ def setup(hass, light_control):
             logger.info("Updating light status")
             update_lights_state.last_updated = datetime.now()
 
-            for light_id, light_state in light_control.gets().items():
-                _update_light_state(light_id, light_state)
+            hass.states.set_multiple(
+                [_light_state(light_id, light_state) for light_id, light_state
+                 in light_control.gets().items()])
 
     # Update light state and discover lights for tracking the group
     update_lights_state(None, True)
@@ -47,10 +47,11 @@ def setup(hass, processes):
         with os.popen(PS_STRING, 'r') as psfile:
             lines = list(psfile)
 
-        for entity_id, pstring in entities.items():
-            state = STATE_ON if any(pstring in l for l in lines) else STATE_OFF
-
-            hass.states.set(entity_id, state)
+        hass.states.set_multiple(
+            [(entity_id,
+              STATE_ON if any(pstring in l for l in lines) else STATE_OFF,
+              None)
+             for entity_id, pstring in entities.items()])
 
     update_process_states(None)
 
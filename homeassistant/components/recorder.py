@@ -0,0 +1,218 @@
+"""
+homeassistant.components.recorder
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Records all events and state changes in a SQLite database so that the
+history can be analysed later.
+
+Listeners only put the events in a queue. A background thread takes them out
+in batches and writes each batch in a single transaction, so the bus never
+waits for the disk. Rows older than keep_days are purged once an hour.
+"""
+import json
+import time
+import queue
+import sqlite3
+import logging
+import datetime as dt
+import threading
+
+import homeassistant as ha
+import homeassistant.remote as rem
+
+DOMAIN = "recorder"
+
+# Maximum number of events written in one transaction
+MAX_BATCH_SIZE = 500
+
+# Seconds between two purges of old rows
+PURGE_INTERVAL = 3600
+
+# Events that are not worth recording
+IGNORED_EVENTS = (ha.EVENT_TIME_CHANGED,)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    event_id INTEGER PRIMARY KEY,
+    event_type TEXT,
+    event_data TEXT,
+    origin TEXT,
+    time_fired REAL);
+
+CREATE TABLE IF NOT EXISTS states (
+    state_id INTEGER PRIMARY KEY,
+    entity_id TEXT,
+    state TEXT,
+    attributes TEXT,
+    last_changed REAL,
+    time_fired REAL,
+    event_id INTEGER);
+
+CREATE INDEX IF NOT EXISTS events__event_type_time_fired
+    ON events (event_type, time_fired);
+
+CREATE INDEX IF NOT EXISTS events__time_fired ON events (time_fired);
+
+CREATE INDEX IF NOT EXISTS states__entity_id_time_fired
+    ON states (entity_id, time_fired);
+
+CREATE INDEX IF NOT EXISTS states__time_fired ON states (time_fired);
+"""
+
+
+def setup(hass, path, keep_days=None):
+    """ Records all events and state changes in the database at path. """
+    logger = logging.getLogger(__name__)
+
+    try:
+        recorder = Recorder(path, keep_days)
+
+    except sqlite3.Error:
+        logger.exception("Error opening recorder database {}".format(path))
+
+        return False
+
+    hass.bus.listen(ha.MATCH_ALL, recorder.event_listener)
+
+    return True
+
+
+class Recorder(threading.Thread):
+    """ Thread that writes the recorded events to the database. """
+
+    def __init__(self, path, keep_days=None):
+        threading.Thread.__init__(self)
+
+        self.daemon = True
+        self.path = path
+        self.keep_days = keep_days
+        self.logger = logging.getLogger(__name__)
+
+        self.queue = queue.Queue()
+
+        # Open the connection here so that errors surface in setup
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Lets query read while a batch is being written
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._last_purge = 0
+
+        self.start()
+
+    def event_listener(self, event):
+        """ Queues the event to be recorded. Does not touch the database. """
+        if event.event_type not in IGNORED_EVENTS:
+            self.queue.put((event, time.time()))
+
+    def run(self):
+        """ Writes the queued events in batches. """
+        while True:
+            batch = [self.queue.get()]
+
+            # Take whatever else is waiting without blocking
+            try:
+                while len(batch) < MAX_BATCH_SIZE:
+                    batch.append(self.queue.get_nowait())
+
+            except queue.Empty:
+                pass
+
+            try:
+                with self._conn:
+                    self._write(batch)
+
+                    self._purge()
+
+            except Exception:  # pylint: disable=broad-except
+                # Keep the thread alive, one bad batch should not stop
+                # the recording of the events that follow
+                self.logger.exception(
+                    "Error recording {} events".format(len(batch)))
+
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, batch):
+        """ Inserts a batch of (event, time fired) tuples. """
+        cursor = self._conn.cursor()
+        states = []
+
+        for event, time_fired in batch:
+            try:
+                event_data = json.dumps(event.data, cls=rem.JSONEncoder)
+
+            except TypeError:
+                # Event data contains something we cannot encode
+                event_data = None
+
+            cursor.execute(
+                "INSERT INTO events (event_type, event_data, origin, "
+                "time_fired) VALUES (?, ?, ?, ?)",
+                (event.event_type, event_data, event.origin.value,
+                 time_fired))
+
+            if event.event_type == ha.EVENT_STATE_CHANGED:
+                state = event.data.get('new_state')
+
+                # Fired through the API with a state we could not decode
+                if not isinstance(state, ha.State):
+                    self.logger.warning(
+                        "Not recording invalid state change: %s", event.data)
+
+                    continue
+
+                states.append(
+                    (state.entity_id, state.state,
+                     json.dumps(state.attributes, cls=rem.JSONEncoder),
+                     state.last_changed.timestamp(), time_fired,
+                     cursor.lastrowid))
+
+        cursor.executemany(
+            "INSERT INTO states (entity_id, state, attributes, "
+            "last_changed, time_fired, event_id) VALUES (?, ?, ?, ?, ?, ?)",
+            states)
+
+    def _purge(self):
+        """ Removes rows older than keep_days, at most once an hour. """
+        now = time.time()
+
+        if not self.keep_days or now - self._last_purge < PURGE_INTERVAL:
+            return
+
+        self._last_purge = now
+
+        purge_before = now - self.keep_days * 86400
+
+        self._conn.execute(
+            "DELETE FROM events WHERE time_fired < ?", (purge_before,))
+        self._conn.execute(
+            "DELETE FROM states WHERE time_fired < ?", (purge_before,))
+
+    def block_till_done(self):
+        """ Blocks till all queued events have been written. """
+        self.queue.join()
+
+    def query(self, sql, params=()):
+        """ Returns the rows matching the query. Safe to call from any
+        thread, it uses its own connection. """
+        conn = sqlite3.connect(self.path)
+
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def get_states(self, entity_id, start_time, end_time=None):
+        """ Returns (state, attributes, last_changed) tuples of entity_id
+        that were recorded between start_time and end_time. """
+        end_time = end_time or dt.datetime.now()
+
+        return [(state, json.loads(attributes),
+                 dt.datetime.fromtimestamp(last_changed))
+                for state, attributes, last_changed in self.query(
+                    "SELECT state, attributes, last_changed FROM states "
+                    "WHERE entity_id = ? AND time_fired >= ? AND "
+                    "time_fired <= ? ORDER BY time_fired",
+                    (entity_id, start_time.timestamp(),
+                     end_time.timestamp()))]
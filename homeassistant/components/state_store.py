@@ -0,0 +1,153 @@
+"""
+homeassistant.components.state_store
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Stores the states on disk so they are available right away after a restart
+instead of being unknown until every component polled its devices.
+
+The store is an append-only log with one state change per line. Each line is
+a compact JSON array [entity_id, state, attributes, last_changed timestamp].
+When the log grows to more than twice the number of entities it is compacted
+by writing the current states to a new file.
+
+Removing an entity fires no event, so removals are not stored. An entity
+that was removed comes back after a restart until it is removed again.
+"""
+import os
+import json
+import logging
+import threading
+import datetime as dt
+
+import homeassistant as ha
+import homeassistant.remote as rem
+
+DOMAIN = "state_store"
+
+# Do not compact logs with less lines than this
+MIN_COMPACT_LINES = 1000
+
+
+def setup(hass, path):
+    """ Restores the states stored at path and stores all state changes. """
+    logger = logging.getLogger(__name__)
+
+    try:
+        states = load(path)
+
+    except OSError:
+        logger.exception("Error reading state store {}".format(path))
+
+        return False
+
+    hass.states.restore(states.values())
+
+    logger.info("Restored {} states from {}".format(len(states), path))
+
+    store = StateStore(hass, path)
+
+    # Start with a compacted log
+    store.compact()
+
+    hass.bus.listen(ha.EVENT_STATE_CHANGED, store.state_changed_listener)
+
+    return True
+
+
+def load(path):
+    """ Returns a dict mapping entity ids to the last stored State. """
+    states = {}
+
+    if not os.path.isfile(path):
+        return states
+
+    with open(path, encoding='UTF-8') as store_file:
+        for line in store_file:
+            try:
+                entity_id, state, attributes, last_changed = json.loads(line)
+
+                states[entity_id] = ha.State(
+                    entity_id, state, attributes,
+                    dt.datetime.fromtimestamp(last_changed))
+
+            except ValueError:
+                # Line was not completely written, skip it
+                pass
+
+    return states
+
+
+def _encode(state):
+    """ Encodes a State as a line for the store. """
+    return json.dumps(
+        [state.entity_id, state.state, state.attributes,
+         state.last_changed.timestamp()],
+        separators=(',', ':'), cls=rem.JSONEncoder) + "\n"
+
+
+class StateStore(object):
+    """ Appends state changes to the log and compacts it when needed. """
+
+    def __init__(self, hass, path):
+        self.hass = hass
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._line_count = 0
+        # Number of lines after which to compact, set by _compact
+        self._compact_at = MIN_COMPACT_LINES
+
+    def state_changed_listener(self, event):
+        """ Appends the new state to the log. """
+        state = event.data.get('new_state')
+
+        # Fired through the API with a state that could not be decoded
+        if not isinstance(state, ha.State):
+            return
+
+        line = _encode(state)
+
+        with self._lock:
+            try:
+                self._file.write(line)
+                self._file.flush()
+
+            except (OSError, AttributeError):
+                # AttributeError if the file could not be opened
+                self.logger.exception("Error writing state store")
+                return
+
+            self._line_count += 1
+
+            if self._line_count > self._compact_at:
+                self._compact()
+
+    def compact(self):
+        """ Rewrites the log to only contain the current states. """
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        """ Rewrites the log. Expects the lock to be held. """
+        states = self.hass.states.all().values()
+
+        temp_path = self.path + ".tmp"
+
+        try:
+            with open(temp_path, 'w', encoding='UTF-8') as temp_file:
+                temp_file.writelines(_encode(state) for state in states)
+
+            if self._file:
+                self._file.close()
+
+            # Atomically replace the old log
+            os.replace(temp_path, self.path)
+
+            self._file = open(self.path, 'a', encoding='UTF-8')
+            self._line_count = len(states)
+            self._compact_at = max(MIN_COMPACT_LINES, 2 * len(states))
+
+        except OSError:
+            self.logger.exception("Error compacting state store")
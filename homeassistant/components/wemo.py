@@ -87,12 +87,9 @@ def setup(hass, hosts=None):
     # Dict mapping entity IDs to devices
     ent_to_dev = {}
 
-    def update_wemo_state(device):
-        """ Update the state of specified WeMo device. """
-
-        # We currently only support switches
-        if not is_switch(device):
-            return
+    def wemo_state(device):
+        """ Returns (entity_id, state, attributes) tuple for the statemachine
+            for specified WeMo switch. """
 
         try:
             entity_id = sno_to_ent[device.serialnumber]
@@ -118,7 +115,14 @@ def setup(hass, hosts=None):
             #state_attr[ATTR_TODAY_ON_TIME] = device.today_on_time
             #state_attr[ATTR_TODAY_STANDBY_TIME] = device.today_standby_time
 
-        hass.states.set(entity_id, state, state_attr)
+        return entity_id, state, state_attr
+
+    def update_wemo_state(device):
+        """ Update the state of specified WeMo device. """
+
+        # We currently only support switches
+        if is_switch(device):
+            hass.states.set(*wemo_state(device))
 
     # pylint: disable=unused-argument
     def update_wemos_state(time, force_reload=False):
@@ -132,8 +136,9 @@ def setup(hass, hosts=None):
             logger.info("Updating WeMo status")
             update_wemos_state.last_updated = datetime.now()
 
-            for device in switches:
-                update_wemo_state(device)
+            hass.states.set_multiple(
+                [wemo_state(device) for device in switches
+                 if is_switch(device)])
 
     update_wemos_state(None, True)
 
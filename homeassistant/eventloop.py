@@ -0,0 +1,122 @@
+"""
+homeassistant.eventloop
+~~~~~~~~~~~~~~~~~~~~~~~
+
+A module containing drop in replacements for core parts that run on an
+asyncio event loop.
+
+Event listeners and services may be coroutine functions. These are run as
+tasks on the event loop without handing them to a worker thread. Regular
+listeners and services are treated as blocking and are offloaded to the
+worker pool, so existing components keep working unchanged.
+"""
+
+import asyncio
+import logging
+import threading
+import datetime as dt
+
+import homeassistant as ha
+
+
+class HomeAssistant(ha.HomeAssistant):
+    """ Home Assistant that runs its core on an asyncio event loop. """
+    # pylint: disable=super-init-not-called
+
+    def __init__(self, precise_timers=False):
+        self.loop = asyncio.new_event_loop()
+
+        self._pool = pool = LoopPool(self.loop, ha.create_worker_pool())
+
+        self.bus = ha.EventBus(pool)
+        self.services = ha.ServiceRegistry(self.bus, pool)
+        self.states = ha.StateMachine(self.bus)
+        self.scheduler = ha.Scheduler(self.bus, pool, precise_timers)
+
+        thread = threading.Thread(target=self.loop.run_forever)
+        thread.daemon = True
+        thread.start()
+
+    def start(self):
+        """ Start home assistant. """
+        self.loop.call_soon_threadsafe(self._timer_tick, False)
+
+        self.bus.fire(ha.EVENT_HOMEASSISTANT_START)
+
+    def _timer_tick(self, fire=True):
+        """ Fires a time_changed event and plans the next one.
+
+        Same schedule as ha.Timer: halfway through every second that is a
+        multiple of TIMER_INTERVAL. """
+        now = dt.datetime.now()
+
+        if fire:
+            self.bus.fire(ha.EVENT_TIME_CHANGED, {ha.ATTR_NOW: now})
+
+        interval = ha.TIMER_INTERVAL
+
+        self.loop.call_later(
+            interval - now.second % interval + .5 - now.microsecond/1000000.0,
+            self._timer_tick)
+
+
+class LoopPool(object):
+    """ Worker pool replacement that runs coroutine functions on the event
+    loop and hands all other jobs to a thread pool. """
+
+    def __init__(self, loop, executor_pool):
+        self._loop = loop
+        self._executor_pool = executor_pool
+        self._logger = logging.getLogger(__name__)
+
+    @property
+    def stats(self):
+        """ Dict with metrics about the pool running the blocking jobs. """
+        return self._executor_pool.stats
+
+    def add_job(self, priority, job, key=None):
+        """ Add a job to be run.
+
+        Coroutines are started in the order they are added. Blocking jobs
+        that share a key are run one after the other. """
+        func, arg = job
+
+        if asyncio.iscoroutinefunction(func):
+            # Avoid the thread safe hand off if we are on the loop already
+            if _running_loop() is self._loop:
+                self._create_task(func(arg))
+            else:
+                self._loop.call_soon_threadsafe(self._create_task, func(arg))
+
+        else:
+            self._executor_pool.add_job(
+                priority, (self._run_blocking, job), key)
+
+    def _run_blocking(self, job):
+        """ Runs a blocking job in a worker thread. """
+        func, arg = job
+
+        result = func(arg)
+
+        # Wrapped coroutine functions, like one time listeners, return a
+        # coroutine that still has to be run on the loop.
+        if asyncio.iscoroutine(result):
+            self._loop.call_soon_threadsafe(self._create_task, result)
+
+    def _create_task(self, coro):
+        """ Schedules coroutine on the loop and logs its exceptions. """
+        self._loop.create_task(coro).add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        """ Logs the exception a task might have raised. """
+        if not task.cancelled() and task.exception():
+            self._logger.error(
+                "LoopPool:Exception doing job", exc_info=task.exception())
+
+
+def _running_loop():
+    """ Returns the event loop running in this thread or None. """
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
@@ -11,19 +11,27 @@ HomeAssistantError will be raised.
 
 import threading
 import logging
+import collections
 import json
 import enum
+import types
+import datetime
 import urllib.parse
 
 import requests
 
 import homeassistant as ha
+import homeassistant.util as util
 
 SERVER_PORT = 8123
 
 URL_API = "/api/"
 URL_API_STATES = "/api/states"
 URL_API_STATES_ENTITY = "/api/states/{}"
+URL_API_CHANGES = "/api/changes"
+URL_API_HISTORY = "/api/history"
+URL_API_STREAM = "/api/stream"
+URL_API_STATS = "/api/stats"
 URL_API_EVENTS = "/api/events"
 URL_API_EVENTS_EVENT = "/api/events/{}"
 URL_API_SERVICES = "/api/services"
@@ -33,6 +41,22 @@ URL_API_EVENT_FORWARD = "/api/event_forwarding"
 METHOD_GET = "get"
 METHOD_POST = "post"
 
+# Events buffered per forwarding target while it is slow or unreachable
+FORWARD_QUEUE_SIZE = 1000
+
+# Maximum number of events forwarded in one request
+FORWARD_BATCH_SIZE = 100
+
+# Seconds to wait before retrying a failed batch, doubles up to the maximum
+FORWARD_RETRY_MIN = 1
+FORWARD_RETRY_MAX = 60
+
+# Failed attempts after which a batch is dropped
+FORWARD_MAX_RETRIES = 5
+
+# Seconds to wait for a target to answer a forwarded batch
+FORWARD_TIMEOUT = 10
+
 
 class APIStatus(enum.Enum):
     """ Represents API status. """
@@ -57,26 +81,37 @@ class API(object):
         self.base_url = "http://{}:{}".format(host, self.port)
         self.status = None
 
+        # Reuses connections to the server. requests.Session is not thread
+        # safe, so every thread that calls the API gets its own session.
+        self._local = threading.local()
+
     def validate_api(self, force_validate=False):
         if self.status is None or force_validate:
             self.status = validate_api(self)
 
         return self.status == APIStatus.OK
 
-    def __call__(self, method, path, data=None):
+    def __call__(self, method, path, data=None, timeout=None):
         """ Makes a call to the Home Assistant api. """
         data = data or {}
         data['api_password'] = self.api_password
 
         url = urllib.parse.urljoin(self.base_url, path)
 
+        session = getattr(self._local, 'session', None)
+
+        if session is None:
+            session = self._local.session = requests.Session()
+
         try:
             if method == METHOD_GET:
-                return requests.get(url, params=data)
+                return session.get(url, params=data, timeout=timeout)
             else:
-                return requests.request(method, url, data=data)
+                return session.request(
+                    method, url, data=data, timeout=timeout)
 
-        except requests.exceptions.ConnectionError:
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
             logging.getLogger(__name__).exception("Error connecting to server")
             raise ha.HomeAssistantError("Error connecting to server")
 
@@ -98,6 +133,7 @@ class HomeAssistant(ha.HomeAssistant):
         self.bus = EventBus(remote_api, pool)
         self.services = ha.ServiceRegistry(self.bus, pool)
         self.states = StateMachine(self.bus, self.remote_api)
+        self.scheduler = ha.Scheduler(self.bus, pool)
 
     def start(self):
         # If there is no local API setup but we do want to connect with remote
@@ -138,19 +174,33 @@ class EventBus(ha.EventBus):
 
 
 class EventForwarder(object):
-    """ Listens for events and forwards to specified APIs. """
+    """ Listens for events and forwards to specified APIs.
 
-    def __init__(self, hass, restrict_origin=None):
+    Every target gets its own ForwardTarget thread that sends the events in
+    batches, so a slow or unreachable target holds up neither the bus nor
+    the other targets. """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, hass, restrict_origin=None, queue_size=None,
+                 drop_oldest=True):
         self.hass = hass
         self.restrict_origin = restrict_origin
+        self.queue_size = queue_size
+        self.drop_oldest = drop_oldest
         self.logger = logging.getLogger(__name__)
 
         # We use a tuple (host, port) as key to ensure
-        # that we do not forward to the same host twice
+        # that we do not forward to the same host twice.
+        # Replaced instead of modified so the listener can go without lock.
         self._targets = {}
 
         self._lock = threading.Lock()
 
+    @property
+    def dropped(self):
+        """ Number of events that were not forwarded. """
+        return sum(target.dropped for target in self._targets.values())
+
     def connect(self, api):
         """
         Attach to a HA instance and forward events.
@@ -164,32 +214,189 @@ class EventForwarder(object):
 
             key = (api.host, api.port)
 
-            self._targets[key] = api
+            targets = dict(self._targets)
+
+            if key in targets:
+                targets[key].stop()
+
+            targets[key] = ForwardTarget(
+                api, self.queue_size, self.drop_oldest)
+
+            self._targets = targets
 
     def disconnect(self, api):
         """ Removes target from being forwarded to. """
         with self._lock:
             key = (api.host, api.port)
 
-            did_remove = self._targets.pop(key, None) is None
+            targets = dict(self._targets)
 
-            if len(self._targets) == 0:
+            target = targets.pop(key, None)
+
+            if target:
+                target.stop()
+
+            self._targets = targets
+
+            if len(targets) == 0:
                 # Remove event listener if no forwarding targets present
                 self.hass.bus.remove_listener(ha.MATCH_ALL,
                                               self._event_listener)
 
-            return did_remove
+            return target is not None
+
+    def block_till_done(self):
+        """ Blocks till all targets have sent or dropped their events. """
+        for target in self._targets.values():
+            target.block_till_done()
 
     def _event_listener(self, event):
-        """ Listen and forwards all events. """
-        with self._lock:
-            # We don't forward time events or, if enabled, non-local events
-            if event.event_type == ha.EVENT_TIME_CHANGED or \
-               (self.restrict_origin and event.origin != self.restrict_origin):
+        """ Queues the event for every target. """
+        # We don't forward time events or, if enabled, non-local events
+        if event.event_type == ha.EVENT_TIME_CHANGED or \
+           (self.restrict_origin and event.origin != self.restrict_origin):
+            return
+
+        for target in self._targets.values():
+            target.put(event)
+
+
+class ForwardTarget(threading.Thread):
+    """ Thread that forwards queued events to an API in batches.
+
+    At most queue_size events are buffered. When the buffer is full the
+    oldest event is dropped to make room, or the new event if drop_oldest is
+    False. A batch that fails because the target cannot be reached or
+    answers with a server error is retried with exponential backoff and
+    dropped after FORWARD_MAX_RETRIES attempts. A batch the target rejects
+    with a client error is dropped right away.
+
+    Targets that do not support firing multiple events at once get the
+    events one request at a time. """
+
+    def __init__(self, api, queue_size=None, drop_oldest=True):
+        threading.Thread.__init__(self)
+
+        self.daemon = True
+        self.api = api
+        self.drop_oldest = drop_oldest
+        self.logger = logging.getLogger(__name__)
+
+        # Number of events that were not forwarded
+        self.dropped = 0
+
+        # Cleared if the target does not support firing multiple events
+        self.bulk = True
+
+        self._queue = collections.deque(
+            maxlen=queue_size or FORWARD_QUEUE_SIZE)
+        self._cond = threading.Condition()
+        self._sending = False
+        self._running = True
+
+        self.start()
+
+    def put(self, event):
+        """ Queues an event to be forwarded. Never blocks on the API. """
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+
+                if not self.drop_oldest:
+                    return
+
+            # Drops the oldest event if the queue is full
+            self._queue.append(event)
+
+            self._cond.notify_all()
+
+    def stop(self):
+        """ Stops forwarding, queued events are discarded. """
+        with self._cond:
+            self._running = False
+
+            self._cond.notify_all()
+
+    def block_till_done(self):
+        """ Blocks till the queue is empty and no batch is being sent. """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: not self._running or
+                not (self._queue or self._sending))
+
+    def run(self):
+        """ Sends the queued events in batches. """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or not self._running)
+
+                if not self._running:
+                    return
+
+                batch = [self._queue.popleft() for _ in
+                         range(min(len(self._queue), FORWARD_BATCH_SIZE))]
+
+                self._sending = True
+
+            self._send(batch)
+
+            with self._cond:
+                self._sending = False
+
+                self._cond.notify_all()
+
+    def _send(self, batch):
+        """ Sends a batch of events. Retries with backoff if the target
+        cannot be reached or answers with a server error. """
+        delay = FORWARD_RETRY_MIN
+
+        for _ in range(FORWARD_MAX_RETRIES):
+            if not self.bulk:
+                for event in batch:
+                    fire_event(self.api, event.event_type, event.data,
+                               self.logger, FORWARD_TIMEOUT)
                 return
 
-            for api in self._targets.values():
-                fire_event(api, event.event_type, event.data, self.logger)
+            try:
+                status_code = fire_events(
+                    self.api,
+                    ((event.event_type, event.data) for event in batch),
+                    self.logger, FORWARD_TIMEOUT)
+
+            except TypeError:
+                # Event data contains something we cannot encode
+                self.logger.exception("Error encoding events")
+                break
+
+            if status_code == 200:
+                return
+
+            elif status_code in (404, 405):
+                # Target runs a version without POST /api/events
+                self.logger.warning(
+                    "{} does not support firing multiple events, forwarding "
+                    "them one at a time".format(self.api.base_url))
+
+                self.bulk = False
+                continue
+
+            elif status_code is not None and status_code < 500:
+                # The target rejected the batch, sending it again will not
+                # help. The error has been logged by fire_events.
+                break
+
+            with self._cond:
+                # Stop waiting right away if we are stopped
+                if self._cond.wait_for(lambda: not self._running, delay):
+                    return
+
+            delay = min(delay * 2, FORWARD_RETRY_MAX)
+
+        self.logger.error("Dropping {} events for {}".format(
+            len(batch), self.api.base_url))
+
+        with self._cond:
+            self.dropped += len(batch)
 
 
 class StateMachine(ha.StateMachine):
@@ -205,6 +412,9 @@ class StateMachine(ha.StateMachine):
 
         self._api = api
 
+        # Sequence number of the remote state machine we are up to date with
+        self._remote_sequence = None
+
         self.mirror()
 
         bus.listen(ha.EVENT_STATE_CHANGED, self._state_changed_listener)
@@ -213,13 +423,50 @@ class StateMachine(ha.StateMachine):
         """ Calls set_state on remote API . """
         set_state(self._api, entity_id, new_state, attributes)
 
+    def set_multiple(self, states):
+        """ Calls set_states on remote API. """
+        set_states(self._api, states, self.logger)
+
     def mirror(self):
-        """ Discards current data and mirrors the remote state machine. """
-        self._states = get_states(self._api, self.logger)
+        """ Brings the mirror up to date with the remote state machine.
+            Only fetches the changes since the last mirror if possible. """
+        result = get_changes(self._api, self._remote_sequence, self.logger)
+
+        if result is None:
+            return
+
+        sequence, states, complete = result
+
+        with self._lock:
+            if complete:
+                # Entities missing from the snapshot have been removed
+                states = dict(states)
+
+                for entity_id in self._states:
+                    states.setdefault(entity_id, None)
+
+            for entity_id, state in states.items():
+                if state:
+                    self._states[entity_id] = state
+
+                elif self._states.pop(entity_id, None) is None:
+                    continue
+
+                self._versions[entity_id] = \
+                    self._versions.get(entity_id, 0) + 1
+                self._log_change(entity_id)
+
+            self._remote_sequence = sequence
 
     def _state_changed_listener(self, event):
         """ Listens for state changed events and applies them. """
-        self._states[event.data['entity_id']] = event.data['new_state']
+        entity_id = event.data['entity_id']
+
+        with self._lock:
+            self._states[entity_id] = event.data['new_state']
+
+            self._versions[entity_id] = self._versions.get(entity_id, 0) + 1
+            self._log_change(entity_id)
 
 
 class JSONEncoder(json.JSONEncoder):
@@ -231,6 +478,14 @@ class JSONEncoder(json.JSONEncoder):
         if isinstance(obj, ha.State):
             return obj.as_dict()
 
+        # The read-only attributes of a State
+        elif isinstance(obj, types.MappingProxyType):
+            return dict(obj)
+
+        # Found in the data of time_changed events
+        elif isinstance(obj, datetime.datetime):
+            return util.datetime_to_str(obj)
+
         return json.JSONEncoder.default(self, obj)
 
 
@@ -297,7 +552,7 @@ def get_event_listeners(api, logger=None):
         return {}
 
 
-def fire_event(api, event_type, event_data=None, logger=None):
+def fire_event(api, event_type, event_data=None, logger=None, timeout=None):
     """ Fire an event at remote API. """
 
     if event_data:
@@ -306,7 +561,8 @@ def fire_event(api, event_type, event_data=None, logger=None):
         data = None
 
     try:
-        req = api(METHOD_POST, URL_API_EVENTS_EVENT.format(event_type), data)
+        req = api(METHOD_POST, URL_API_EVENTS_EVENT.format(event_type), data,
+                  timeout)
 
         if req.status_code != 200 and logger:
             logger.error(
@@ -317,6 +573,32 @@ def fire_event(api, event_type, event_data=None, logger=None):
         pass
 
 
+def fire_events(api, events, logger=None, timeout=None):
+    """ Fires multiple events at remote API in one request.
+
+    Events is an iterable of (event_type, event_data) tuples. Returns the
+    status code of the response, 200 if the events were fired, or None if
+    the API could not be reached. """
+
+    data = {'events': json.dumps(
+        [{'event_type': event_type, 'event_data': event_data}
+         for event_type, event_data in events],
+        cls=JSONEncoder)}
+
+    try:
+        req = api(METHOD_POST, URL_API_EVENTS, data, timeout)
+
+        if req.status_code != 200 and logger:
+            logger.error(
+                "Error firing events: {} - {}".format(
+                    req.status_code, req.text))
+
+        return req.status_code
+
+    except ha.HomeAssistantError:
+        return None
+
+
 def get_state(api, entity_id, logger=None):
     """ Queries given API for state of entity_id. """
 
@@ -364,13 +646,43 @@ def get_states(api, logger=None):
         return {}
 
 
+def get_changes(api, since=None, logger=None):
+    """ Queries given API for the states that changed since sequence since,
+    as returned by an earlier call. Returns a tuple (sequence, states,
+    complete) or None on error.
+
+    If complete is True the states are all the states of the API, else
+    states maps changed entity ids to their state or None if removed. """
+
+    try:
+        req = api(METHOD_GET, URL_API_CHANGES,
+                  {'since': since} if since is not None else None)
+
+        json_result = req.json()
+
+        states = {entity_id: ha.State.from_dict(state_dict)
+                  for entity_id, state_dict
+                  in json_result['states'].items()}
+
+        return json_result['sequence'], states, json_result['complete']
+
+    except (ha.HomeAssistantError, ValueError, KeyError, AttributeError):
+        # ValueError if req.json() can't parse the json
+        # KeyError if not all expected keys are in the returned JSON
+        # AttributeError if parsed JSON was not a dict
+        if logger:
+            logger.exception("Error getting changes")
+
+        return None
+
+
 def set_state(api, entity_id, new_state, attributes=None, logger=None):
     """ Tells API to update state for entity_id. """
 
     attributes = attributes or {}
 
     data = {'new_state': new_state,
-            'attributes': json.dumps(attributes)}
+            'attributes': json.dumps(attributes, cls=JSONEncoder)}
 
     try:
         req = api(METHOD_POST,
@@ -387,6 +699,61 @@ def set_state(api, entity_id, new_state, attributes=None, logger=None):
             logger.exception("Error setting state to server")
 
 
+def set_states(api, states, logger=None):
+    """ Tells API to update the states of multiple entities in one request.
+
+    States is an iterable of (entity_id, new_state, attributes) tuples.
+    Returns a list with for each state the new State or None if it was not
+    accepted. Returns None if the request failed.
+
+    APIs of a version without POST /api/states get one request per state,
+    in that case None is returned as well. """
+
+    states = list(states)
+
+    data = {'states': json.dumps(
+        [{'entity_id': entity_id, 'state': new_state,
+          'attributes': attributes or {}}
+         for entity_id, new_state, attributes in states],
+        cls=JSONEncoder)}
+
+    try:
+        req = api(METHOD_POST, URL_API_STATES, data)
+
+        if req.status_code in (404, 405):
+            if logger:
+                logger.warning(
+                    "{} does not support setting multiple states, setting "
+                    "them one at a time".format(api.base_url))
+
+            for entity_id, new_state, attributes in states:
+                set_state(api, entity_id, new_state, attributes, logger)
+
+            return None
+
+        elif req.status_code != 200:
+            if logger:
+                logger.error(
+                    "Error changing states: {} - {}".format(
+                        req.status_code, req.text))
+
+            return None
+
+        return [ha.State.from_dict(result) for result in req.json()]
+
+    except ha.HomeAssistantError:
+        if logger:
+            logger.exception("Error setting states to server")
+
+    except (ValueError, AttributeError):
+        # ValueError if req.json() can't parse the json
+        # AttributeError if parsed JSON was not a list
+        if logger:
+            logger.exception("Error parsing states result")
+
+    return None
+
+
 def is_state(api, entity_id, state, logger=None):
     """ Queries API to see if entity_id is specified state. """
     cur_state = get_state(api, entity_id, logger)
@@ -6,14 +6,28 @@ Provides tests to verify that Home Assistant modules do what they should do.
 
 """
 
+import os
+import gzip
+import json
 import unittest
 import time
+import asyncio
+import threading
+import datetime as dt
+import tempfile
+from http.client import HTTPConnection
 
 import requests
 
 import homeassistant as ha
+import homeassistant.util as util
+import homeassistant.eventloop as eventloop
 import homeassistant.remote as remote
 import homeassistant.components.http as http
+import homeassistant.components.group as group
+import homeassistant.components.state_store as state_store
+import homeassistant.components.recorder as recorder
+import homeassistant.components.history as history
 
 API_PASSWORD = "test1234"
 
@@ -40,7 +54,7 @@ def ensure_homeassistant_started():
         hass.bus.listen('test_event', len)
         hass.states.set('test', 'a_state')
 
-        http.setup(hass, API_PASSWORD)
+        http.setup(hass, API_PASSWORD, history=history.History(hass))
 
         hass.start()
 
@@ -72,6 +86,685 @@ def ensure_slave_started():
     return HAHelper.slave
 
 
+class TestHomeAssistant(unittest.TestCase):
+    """ Test the Home Assistant core classes. """
+
+    def setUp(self):    # pylint: disable=invalid-name
+        """ things to be run when tests are started. """
+        self.hass = ha.HomeAssistant()
+
+    def test_track_state_change_only_schedules_entity(self):
+        """ Test that state listeners only run for their own entity. """
+        calls = []
+
+        self.hass.states.set("light.Bowl", "off")
+        self.hass.states.set("light.Ceiling", "off")
+
+        self.hass.track_state_change(
+            "light.Bowl", lambda entity_id, old, new: calls.append(entity_id))
+
+        self.assertEqual(
+            self.hass.bus.listeners.get(ha.EVENT_STATE_CHANGED), 1)
+
+        self.hass.states.set("light.Ceiling", "on")
+        self.hass.states.set("light.Bowl", "on")
+
+        # Allow the listeners to run
+        time.sleep(.1)
+
+        self.assertEqual(calls, ["light.Bowl"])
+
+    def test_set_multiple(self):
+        """ Test setting multiple states at once. """
+        changed = []
+
+        self.hass.states.set("light.Bowl", "off")
+
+        self.hass.bus.listen(
+            ha.EVENT_STATE_CHANGED,
+            lambda event: changed.append(event.data['entity_id']))
+
+        self.hass.states.set_multiple([("light.Bowl", "on", None),
+                                       ("light.Ceiling", "on", {'xy': 1}),
+                                       ("light.Bowl", "on", None)])
+
+        # Allow the listeners to run
+        time.sleep(.1)
+
+        self.assertEqual(sorted(changed), ["light.Bowl", "light.Ceiling"])
+        self.assertEqual(
+            self.hass.states.get("light.Ceiling").attributes, {'xy': 1})
+
+    def test_changes_since(self):
+        """ Test getting the changes since a sequence number. """
+        states = self.hass.states
+
+        states.set("light.Bowl", "off")
+        states.set("light.Ceiling", "off")
+
+        sequence = states.sequence
+
+        states.set("light.Bowl", "on")
+        states.set("light.Bowl", "off")
+        states.set("light.TV", "on")
+        states.remove("light.Ceiling")
+
+        self.assertEqual(states.get_version("light.Bowl"), 3)
+
+        # Versions keep counting when an entity is removed and added again
+        self.assertEqual(states.get_version("light.Ceiling"), 2)
+
+        new_sequence, changes = states.changes_since(sequence)
+
+        self.assertEqual(new_sequence, sequence + 4)
+        self.assertEqual(changes, {"light.Bowl": states.get("light.Bowl"),
+                                   "light.TV": states.get("light.TV"),
+                                   "light.Ceiling": None})
+
+        self.assertEqual(states.changes_since(new_sequence),
+                         (new_sequence, {}))
+        self.assertIsNone(states.changes_since(new_sequence + 1))
+
+        for number in range(ha.CHANGE_LOG_SIZE + 1):
+            states.set("light.Bowl", str(number))
+
+        self.assertIsNone(states.changes_since(new_sequence))
+
+        states.set("light.Ceiling", "on")
+
+        self.assertEqual(states.get_version("light.Ceiling"), 3)
+
+    def test_states_are_immutable(self):
+        """ Test that states can be shared because they are immutable. """
+        attributes = {'brightness': 100}
+
+        self.hass.states.set("light.Bowl", "on", attributes)
+        attributes['brightness'] = 200
+
+        state = self.hass.states.get("light.Bowl")
+
+        self.assertIs(state, self.hass.states.all()["light.Bowl"])
+        self.assertEqual(state.attributes, {'brightness': 100})
+
+        with self.assertRaises(TypeError):
+            state.attributes['brightness'] = 200
+
+        with self.assertRaises(AttributeError):
+            state.state = "off"
+
+    def test_state_store(self):
+        """ Test that stored states are restored after a restart. """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "states.log")
+
+            self.assertTrue(state_store.setup(self.hass, path))
+
+            self.hass.states.set("light.Bowl", "on", {'brightness': 100})
+            self.hass.states.set("light.Ceiling", "on")
+            self.hass.states.set("light.Ceiling", "off")
+
+            # Allow the listeners to run
+            time.sleep(.1)
+
+            bowl = self.hass.states.get("light.Bowl")
+
+            # Partially written last line should be ignored
+            with open(path, 'a') as store_file:
+                store_file.write('["light.Bowl","off"')
+
+            hass = ha.HomeAssistant()
+            hass.states.set("light.TV", "on")
+
+            self.assertTrue(state_store.setup(hass, path))
+
+            self.assertEqual(hass.states.get("light.Bowl"), bowl)
+            self.assertEqual(hass.states.get("light.Bowl").last_changed,
+                             bowl.last_changed)
+            self.assertEqual(hass.states.get("light.Ceiling").state, "off")
+            self.assertEqual(hass.states.get("light.TV").state, "on")
+
+            # Log has been compacted on setup
+            with open(path) as store_file:
+                self.assertEqual(len(store_file.readlines()), 3)
+
+    def test_state_store_skips_invalid_state_change(self):
+        """ Test that a state_changed event without a valid state is not
+            stored. """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "states.log")
+
+            store = state_store.StateStore(self.hass, path)
+            store.compact()
+
+            # As fired through the API when the state cannot be decoded
+            store.state_changed_listener(ha.Event(
+                ha.EVENT_STATE_CHANGED, {'new_state': {'state': "on"}}))
+            store.state_changed_listener(ha.Event(
+                ha.EVENT_STATE_CHANGED,
+                {'entity_id': "light.Bowl",
+                 'new_state': ha.State("light.Bowl", "on")}))
+
+            self.assertEqual(list(state_store.load(path)), ["light.Bowl"])
+
+    def test_recorder(self):
+        """ Test that events and state changes are recorded. """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            recorder_thread = recorder.Recorder(
+                os.path.join(temp_dir, "home-assistant.db"))
+
+            self.hass.bus.listen(ha.MATCH_ALL, recorder_thread.event_listener)
+
+            start = dt.datetime.now() - dt.timedelta(seconds=1)
+
+            self.hass.states.set("light.Bowl", "on", {'brightness': 100})
+            self.hass.states.set("light.Bowl", "off")
+            self.hass.bus.fire("test_event", {'now': dt.datetime.now()})
+            self.hass.bus.fire(ha.EVENT_TIME_CHANGED,
+                               {ha.ATTR_NOW: dt.datetime.now()})
+
+            # Allow the listeners to run and the recorder to write
+            time.sleep(.1)
+            recorder_thread.block_till_done()
+
+            self.assertEqual(
+                [(state, attributes) for state, attributes, _
+                 in recorder_thread.get_states("light.Bowl", start)],
+                [("on", {'brightness': 100}), ("off", {})])
+
+            self.assertEqual(
+                recorder_thread.query(
+                    "SELECT event_type, COUNT(*) FROM events "
+                    "GROUP BY event_type ORDER BY event_type"),
+                [(ha.EVENT_STATE_CHANGED, 2), ("test_event", 1)])
+
+    def test_recorder_skips_invalid_state_change(self):
+        """ Test that a state_changed event without a valid state does not
+            stop the recorder. """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            recorder_thread = recorder.Recorder(
+                os.path.join(temp_dir, "home-assistant.db"))
+
+            start = dt.datetime.now() - dt.timedelta(seconds=1)
+
+            # As fired through the API when the state cannot be decoded
+            recorder_thread.event_listener(ha.Event(
+                ha.EVENT_STATE_CHANGED, {'new_state': {'state': "on"}}))
+            recorder_thread.event_listener(ha.Event(
+                ha.EVENT_STATE_CHANGED, {}))
+            recorder_thread.block_till_done()
+
+            recorder_thread.event_listener(ha.Event(
+                ha.EVENT_STATE_CHANGED,
+                {'entity_id': "light.Bowl",
+                 'new_state': ha.State("light.Bowl", "on")}))
+            recorder_thread.block_till_done()
+
+            self.assertTrue(recorder_thread.is_alive())
+            self.assertEqual(
+                [state for state, _, _
+                 in recorder_thread.get_states("light.Bowl", start)],
+                ["on"])
+
+    def test_history_downsample(self):
+        """ Test that history keeps bounded timelines and downsamples them. """
+        timeline = history.Timeline(3)
+
+        for timestamp, state in ((0, "off"), (10, "on"), (12, "on"),
+                                 (30, "off"), (35, "on")):
+            timeline.add(timestamp, state)
+
+        # Oldest change dropped, repeated state not added
+        self.assertEqual(list(timeline.times), [10, 30, 35])
+
+        self.assertEqual(timeline.points(20, 40),
+                         [(20, "on"), (30, "off"), (35, "on")])
+
+        self.assertEqual(
+            history.downsample(timeline.points(20, 40), 20, 40, 2),
+            [(20, "on"), (30, "off")])
+
+    def test_group_state_under_burst(self):
+        """ Test that a group ends in the right state after a burst of
+            interleaved state changes of its entities. """
+        entity_ids = ["light.light_{}".format(number) for number in range(5)]
+
+        for entity_id in entity_ids:
+            self.hass.states.set(entity_id, "off")
+
+        group.setup(self.hass, "burst", entity_ids)
+
+        for number in range(3000):
+            self.hass.states.set(entity_ids[number % 5],
+                                 "on" if number % 7 < 3 else "off")
+
+        for entity_id in entity_ids[:4]:
+            self.hass.states.set(entity_id, "off")
+
+        # Allow the listeners to run
+        time.sleep(1)
+
+        self.assertEqual(
+            self.hass.states.get("group.burst").state,
+            self.hass.states.get(entity_ids[4]).state)
+
+    def test_listeners_changed_during_fire(self):
+        """ Test that fire uses the listeners of when it started and the next
+            fire sees listeners that were added or removed meanwhile. """
+        scheduled = []
+
+        def first(event):
+            """ Listener that is scheduled first. """
+
+        def removed(event):
+            """ Listener that is removed while the bus fires. """
+
+        def added(event):
+            """ Listener that is added while the bus fires. """
+
+        class ChangingPool(object):  # pylint: disable=too-few-public-methods
+            """ Pool that changes the listeners when the first job comes. """
+
+            @staticmethod
+            def add_job(priority, job, key=None):
+                """ Records the scheduled listener. """
+                scheduled.append(job[0])
+
+                if len(scheduled) == 1:
+                    bus.listen('test_event', added)
+                    bus.remove_listener('test_event', removed)
+
+        bus = ha.EventBus(ChangingPool())
+
+        bus.listen('test_event', first)
+        bus.listen('test_event', removed)
+
+        bus.fire('test_event')
+
+        self.assertEqual(scheduled, [first, removed])
+
+        bus.fire('test_event')
+
+        self.assertEqual(scheduled[2:], [first, added])
+
+    def test_trace_sample(self):
+        """ Test that tracing logs a sample of the events. """
+        bus = ha.EventBus(util.ThreadPool(0, len))
+
+        ha.enable_trace(5)
+
+        try:
+            with self.assertLogs('homeassistant.trace') as logs:
+                for _ in range(20):
+                    bus.fire('test_event')
+        finally:
+            ha.enable_trace(0)
+
+        self.assertEqual(len(logs.output), 4)
+
+    def test_scheduler_only_runs_due_jobs(self):
+        """ Test that the scheduler only runs jobs whose time has come. """
+        calls = []
+        now = dt.datetime.now()
+
+        self.hass.track_point_in_time(
+            lambda now: calls.append('due'), now - dt.timedelta(seconds=1))
+        self.hass.track_point_in_time(
+            lambda now: calls.append('later'), now + dt.timedelta(hours=1))
+        job = self.hass.track_point_in_time(
+            lambda now: calls.append('cancelled'),
+            now - dt.timedelta(seconds=1))
+        job.cancel()
+
+        self.assertEqual(
+            self.hass.bus.listeners.get(ha.EVENT_TIME_CHANGED), 1)
+
+        for _ in range(2):
+            self.hass.bus.fire(ha.EVENT_TIME_CHANGED, {ha.ATTR_NOW: now})
+
+        # Allow the jobs to run
+        time.sleep(.1)
+
+        self.assertEqual(calls, ['due'])
+        self.assertEqual(len(self.hass.scheduler.jobs), 1)
+
+    def test_scheduler_follows_wall_clock(self):
+        """ Test that jobs run when the wall clock reaches their time, also
+            if it jumps, and that lateness is measured against the deadline
+            that was due. """
+        calls = []
+        now = dt.datetime.now()
+
+        def later(now):
+            """ Records the run. """
+            calls.append('later')
+
+        def every_second(now):
+            """ Records the run. """
+            calls.append('every_second')
+
+        self.hass.track_point_in_time(later, now + dt.timedelta(hours=1))
+        self.hass.track_time_change(every_second)
+
+        time.sleep(1.1)
+
+        self.hass.bus.fire(ha.EVENT_TIME_CHANGED,
+                           {ha.ATTR_NOW: dt.datetime.now()})
+
+        # Allow the jobs to run
+        time.sleep(.1)
+
+        self.assertEqual(calls, ['every_second'])
+
+        lateness = self.hass.scheduler.lateness['every_second']
+
+        self.assertGreaterEqual(lateness['average'], 0)
+        self.assertLess(lateness['average'], 1.2)
+        self.assertEqual(lateness['max'], lateness['average'])
+
+        # The clock was moved an hour ahead, as with DST
+        self.hass.bus.fire(ha.EVENT_TIME_CHANGED,
+                           {ha.ATTR_NOW: now + dt.timedelta(hours=1)})
+
+        # Allow the jobs to run
+        time.sleep(.1)
+
+        self.assertIn('later', calls)
+
+    def test_scheduler_pattern_window(self):
+        """ Test that pattern jobs only run on ticks matching the pattern,
+            also if their window passed between two ticks. """
+        calls = []
+
+        # A minute far from now so the job waits for the start of its window,
+        # not 0 as track_time_change takes that for any minute
+        minute = (dt.datetime.now().minute + 30) % 60 or 1
+
+        job = self.hass.track_time_change(calls.append, minute=minute)
+
+        window = job.next_run
+
+        for offset in (-10, 0, 10, 60, 120):
+            self.hass.bus.fire(ha.EVENT_TIME_CHANGED, {
+                ha.ATTR_NOW: window + dt.timedelta(seconds=offset + .5)})
+
+        # Allow the jobs to run
+        time.sleep(.1)
+
+        self.assertEqual([now.minute for now in calls], [minute, minute])
+        self.assertEqual(job.next_run, window + dt.timedelta(hours=1))
+
+    def test_precise_scheduler(self):
+        """ Test that precise timers fire at their deadline without
+            time_changed events and record their lateness. """
+        hass = ha.HomeAssistant(precise_timers=True)
+        calls = []
+
+        def action(now):
+            """ Records when the action ran. """
+            calls.append(now)
+
+        point_in_time = dt.datetime.now() + dt.timedelta(milliseconds=200)
+
+        hass.track_point_in_time(action, point_in_time)
+
+        time.sleep(.4)
+
+        self.assertEqual(len(calls), 1)
+        self.assertGreaterEqual(calls[0], point_in_time)
+
+        lateness = hass.scheduler.lateness['action']
+
+        self.assertEqual(lateness['count'], 1)
+        self.assertLess(lateness['max'], .1)
+
+    def test_precise_scheduler_jobs(self):
+        """ Test listing pattern and point in time jobs in precise mode. """
+        hass = ha.HomeAssistant(precise_timers=True)
+
+        def later(now):
+            """ Does nothing. """
+
+        def every_minute(now):
+            """ Does nothing. """
+
+        hass.track_point_in_time(later,
+                                 dt.datetime.now() + dt.timedelta(hours=1))
+        hass.track_time_change(every_minute, second=0)
+
+        self.assertEqual([job.name for job in hass.scheduler.jobs],
+                         ['every_minute', 'later'])
+
+    def test_next_time_match(self):
+        """ Test calculating the next time a time pattern matches. """
+        # pylint: disable=protected-access
+        pattern = (ha.MATCH_ALL, [2], [29], [8], ha.MATCH_ALL, [0, 30])
+
+        self.assertEqual(
+            dt.datetime(2016, 2, 29, 8, 0, 0),
+            ha._next_time_match(pattern, dt.datetime(2014, 10, 1, 12)))
+
+        self.assertEqual(
+            dt.datetime(2016, 2, 29, 8, 0, 30),
+            ha._next_time_match(pattern, dt.datetime(2016, 2, 29, 8, 0, 0)))
+
+        self.assertIsNone(
+            ha._next_time_match(([2014],) + pattern[1:],
+                                dt.datetime(2014, 10, 1, 12)))
+
+
+class TestThreadPool(unittest.TestCase):
+    """ Test the worker pool. """
+
+    def test_reserved_lane_and_growth(self):
+        """ Test that important jobs are not stuck behind slow jobs and
+            that the pool grows under load and reports metrics. """
+        done = []
+
+        def job_handler(job):
+            """ Sleeps for the requested time and records the job. """
+            name, duration = job
+            time.sleep(duration)
+            done.append(name)
+
+        pool = util.ThreadPool(1, job_handler, max_worker_count=3,
+                               reserved_workers={ha.JobPriority.EVENT_SERVICE:
+                                                 1})
+
+        for _ in range(5):
+            pool.add_job(ha.JobPriority.EVENT_TIME, ('slow', .5))
+
+        pool.add_job(ha.JobPriority.EVENT_SERVICE, ('service', 0))
+
+        time.sleep(.1)
+
+        self.assertEqual(done, ['service'])
+        self.assertEqual(pool.stats['workers'], 3)
+
+        time.sleep(1.5)
+
+        stats = pool.stats
+
+        self.assertEqual(stats['jobs_done'], 6)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertGreater(stats['max_wait_time'], .4)
+
+    def test_grows_when_no_worker_is_idle(self):
+        """ Test that a job does not wait while all workers are blocked. """
+        done = []
+        release = threading.Event()
+
+        def job_handler(job):
+            """ Blocks on the block jobs and records the others. """
+            if job == 'block':
+                release.wait()
+            else:
+                done.append(job)
+
+        pool = util.ThreadPool(2, job_handler, max_worker_count=4)
+
+        try:
+            pool.add_job(ha.JobPriority.EVENT_DEFAULT, 'block')
+            pool.add_job(ha.JobPriority.EVENT_DEFAULT, 'block')
+
+            time.sleep(.1)
+
+            pool.add_job(ha.JobPriority.EVENT_DEFAULT, 'quick')
+
+            time.sleep(.1)
+
+            self.assertEqual(done, ['quick'])
+            self.assertEqual(pool.stats['workers'], 3)
+
+        finally:
+            release.set()
+
+    def test_fifo_within_priority(self):
+        """ Test that jobs with the same priority run in order. """
+        done = []
+        blocking = threading.Event()
+        started = threading.Event()
+
+        def job_handler(job):
+            """ Blocks on the first job and records the others. """
+            if job == 'block':
+                blocking.set()
+                started.wait()
+            else:
+                done.append(job)
+
+        pool = util.ThreadPool(1, job_handler)
+
+        pool.add_job(ha.JobPriority.EVENT_DEFAULT, 'block')
+
+        # Queue the other jobs only once the worker is blocked
+        blocking.wait(1)
+
+        for number in range(100):
+            pool.add_job(ha.JobPriority.EVENT_STATE, number)
+
+        pool.add_job(ha.JobPriority.EVENT_SERVICE, 'service')
+
+        started.set()
+        time.sleep(.1)
+
+        self.assertEqual(done, ['service'] + list(range(100)))
+
+
+class TestEventLoop(unittest.TestCase):
+    """ Test the asyncio based core. """
+
+    def setUp(self):    # pylint: disable=invalid-name
+        """ things to be run when tests are started. """
+        self.hass = eventloop.HomeAssistant()
+
+    def test_coroutine_and_blocking_listeners(self):
+        """ Test that coroutine listeners run on the loop and blocking
+            listeners in a worker thread. """
+        calls = []
+
+        async def coro_listener(event):
+            """ Coroutine listener. """
+            calls.append(('coro', threading.current_thread().name))
+
+        def blocking_listener(event):
+            """ Blocking listener. """
+            calls.append(('blocking', threading.current_thread().name))
+
+        self.hass.bus.listen('test_event', coro_listener)
+        self.hass.bus.listen('test_event', blocking_listener)
+        self.hass.listen_once_event('test_event', coro_listener)
+
+        self.hass.bus.fire('test_event')
+        self.hass.bus.fire('test_event')
+
+        # Allow the listeners to run
+        time.sleep(.2)
+
+        loop_calls = [name for kind, name in calls if kind == 'coro']
+        blocking_calls = [name for kind, name in calls if kind == 'blocking']
+
+        self.assertEqual(len(loop_calls), 3)
+        self.assertEqual(len(set(loop_calls)), 1)
+        self.assertEqual(len(blocking_calls), 2)
+        self.assertNotIn(loop_calls[0], blocking_calls)
+
+    def test_coroutine_service(self):
+        """ Test that services can be coroutines. """
+        calls = []
+
+        async def service(call):
+            """ Coroutine service. """
+            await asyncio.sleep(0)
+            calls.append(call)
+
+        self.hass.services.register('test_domain', 'test_service', service)
+        self.hass.call_service('test_domain', 'test_service')
+
+        # Allow the service to run
+        time.sleep(.2)
+
+        self.assertEqual(len(calls), 1)
+
+
+def _assert_streams_events(test, hass, port):
+    """ Asserts that /api/stream on port streams the filtered events. """
+    conn = HTTPConnection("127.0.0.1", port, timeout=5)
+
+    try:
+        conn.request(
+            "GET", "{}?api_password={}&event_type=test_stream&entity_id=a"
+            .format(remote.URL_API_STREAM, API_PASSWORD))
+
+        response = conn.getresponse()
+
+        test.assertEqual(response.getheader('Content-type'),
+                         'text/event-stream')
+
+        # Let the server subscribe before firing
+        time.sleep(.1)
+
+        hass.bus.fire("test_stream", {ha.ATTR_ENTITY_ID: "b"})
+        hass.bus.fire("test_other", {ha.ATTR_ENTITY_ID: "a"})
+        hass.bus.fire("test_stream", {ha.ATTR_ENTITY_ID: "a", 'nr': 1})
+
+        test.assertEqual(
+            json.loads(response.readline().decode()[len("data: "):]),
+            {'event_type': 'test_stream', 'origin': 'LOCAL',
+             'data': {ha.ATTR_ENTITY_ID: "a", 'nr': 1}})
+
+    finally:
+        conn.close()
+
+
+class TestAsyncioHTTPServer(unittest.TestCase):
+    """ Test the asyncio HTTP server. """
+
+    def test_requests_on_persistent_connection(self):
+        """ Test that the asyncio server handles the API requests. """
+        hass = eventloop.HomeAssistant()
+        hass.states.set("test.asyncio", "on")
+
+        http.setup(hass, API_PASSWORD, 8125, use_asyncio=True)
+
+        hass.start()
+
+        # Give the server time to start
+        time.sleep(.5)
+
+        api = remote.API("127.0.0.1", API_PASSWORD, 8125)
+
+        self.assertEqual(remote.validate_api(api), remote.APIStatus.OK)
+        self.assertEqual(remote.get_state(api, "test.asyncio").state, "on")
+
+        remote.set_state(api, "test.asyncio", "off")
+        self.assertEqual(hass.states.get("test.asyncio").state, "off")
+
+        self.assertEqual(api(remote.METHOD_GET, "/api/unknown").status_code,
+                         404)
+
+        _assert_streams_events(self, hass, 8125)
+
+
 # pylint: disable=too-many-public-methods
 class TestHTTPInterface(unittest.TestCase):
     """ Test the HTTP debug interface and API. """
@@ -81,6 +774,85 @@ class TestHTTPInterface(unittest.TestCase):
         """ things to be run when tests are started. """
         cls.hass = ensure_homeassistant_started()
 
+    def test_router(self):
+        """ Test that the router picks the same route as a linear search. """
+        router = http.RequestHandler.ROUTER
+
+        self.assertEqual(router.match('GET', '/api/states'),
+                         ('_handle_get_api_states', True))
+
+        handler, path_match = router.match('POST', '/api/states/light.Bowl')
+
+        self.assertEqual(handler, '_handle_change_state')
+        self.assertEqual(path_match.group('entity_id'), 'light.Bowl')
+
+        handler, path_match = router.match('POST', '/api/services/light/on')
+
+        self.assertEqual(handler, '_handle_call_service')
+        self.assertEqual(path_match.groupdict(),
+                         {'domain': 'light', 'service': 'on'})
+
+        self.assertEqual(router.match('DELETE', '/api/states/light.Bowl'),
+                         (False, None))
+        self.assertEqual(router.match('POST', '/api/changes'), (False, None))
+        self.assertEqual(router.match('GET', '/api/unknown'), (None, None))
+
+    def test_keep_alive(self):
+        """ Test that multiple requests can be made over one connection. """
+        conn = HTTPConnection("127.0.0.1", remote.SERVER_PORT)
+
+        try:
+            for path in ("/api/states/test", "/api/unknown", "/", "/api/"):
+                conn.request(
+                    "GET", "{}?api_password={}".format(path, API_PASSWORD))
+
+                response = conn.getresponse()
+                body = response.read()
+
+                self.assertFalse(response.will_close)
+
+                # The debug interface is sent in chunks
+                if path == "/":
+                    self.assertEqual(response.getheader('Transfer-Encoding'),
+                                     'chunked')
+                else:
+                    self.assertEqual(
+                        int(response.getheader('Content-Length')), len(body))
+
+        finally:
+            conn.close()
+
+    def test_idle_connections_hold_no_worker(self):
+        """ Test that requests are answered right away while more idle keep
+            alive connections are open than the pool has workers. """
+        idle = [HTTPConnection("127.0.0.1", remote.SERVER_PORT, timeout=5)
+                for _ in range(http.POOL_MAX_THREAD + 2)]
+
+        try:
+            for conn in idle:
+                conn.request(
+                    "GET", "/api/?api_password={}".format(API_PASSWORD))
+                conn.getresponse().read()
+
+            start = time.monotonic()
+
+            req = requests.get(_url(remote.URL_API),
+                               params={"api_password": API_PASSWORD},
+                               timeout=5)
+
+            self.assertEqual(req.status_code, 200)
+            self.assertLess(time.monotonic() - start, 1)
+
+            # The idle connections are still usable
+            idle[0].request(
+                "GET", "/api/?api_password={}".format(API_PASSWORD))
+
+            self.assertEqual(idle[0].getresponse().status, 200)
+
+        finally:
+            for conn in idle:
+                conn.close()
+
     def test_debug_interface(self):
         """ Test if we can login by comparing not logged in screen to
             logged in screen. """
@@ -106,6 +878,66 @@ class TestHTTPInterface(unittest.TestCase):
 
         self.assertEqual(req.status_code, 401)
 
+    def test_debug_interface_filter(self):
+        """ Test filtering and paging the states of the debug interface. """
+        self.hass.states.set_multiple(
+            ("test_page.entity_{:03}".format(number), "on", None)
+            for number in range(http.STATES_PER_PAGE + 1))
+
+        req = requests.get(_url(), params={"api_password": API_PASSWORD,
+                                           "domain": "test_page",
+                                           "page": 2})
+
+        self.assertIn("test_page.entity_{:03}".format(http.STATES_PER_PAGE),
+                      req.text)
+        self.assertNotIn("test_page.entity_000", req.text)
+        self.assertNotIn("<td>test</td>", req.text)
+
+    def test_static_files(self):
+        """ Test serving static files with caching headers and gzip. """
+        req = requests.get(_url("/static/style.css"))
+
+        self.assertEqual(req.headers['Content-type'], 'text/css')
+        self.assertIn('max-age', req.headers['Cache-Control'])
+
+        for header, value in (('If-None-Match', req.headers['ETag']),
+                              ('If-Modified-Since',
+                               req.headers['Last-Modified'])):
+            self.assertEqual(
+                requests.get(_url("/static/style.css"),
+                             headers={header: value}).status_code, 304)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, "test.js"), 'w') as plain:
+                plain.write("plain")
+
+            with gzip.open(os.path.join(temp_dir, "test.js.gz"), 'wt') as gzd:
+                gzd.write("gzipped")
+
+            static_dir, http.STATIC_DIR = http.STATIC_DIR, temp_dir
+
+            try:
+                req = requests.get(_url("/static/test.js"),
+                                   headers={'Accept-Encoding': 'gzip'})
+
+                self.assertEqual(req.headers['Content-Encoding'], 'gzip')
+                self.assertEqual(req.text, "gzipped")
+
+                req = requests.get(_url("/static/test.js"),
+                                   headers={'Accept-Encoding': 'identity'})
+
+                self.assertNotIn('Content-Encoding', req.headers)
+                self.assertEqual(req.text, "plain")
+
+                req = requests.get(_url("/static/test.js"),
+                                   headers={'Accept-Encoding': 'gzip;q=0'})
+
+                self.assertNotIn('Content-Encoding', req.headers)
+                self.assertEqual(req.text, "plain")
+
+            finally:
+                http.STATIC_DIR = static_dir
+
     def test_debug_change_state(self):
         """ Test if we can change a state from the debug interface. """
         self.hass.states.set("test.test", "not_to_be_set")
@@ -167,6 +999,77 @@ class TestHTTPInterface(unittest.TestCase):
         self.assertEqual(data.last_changed, state.last_changed)
         self.assertEqual(data.attributes, state.attributes)
 
+    def test_api_states_etag(self):
+        """ Test if unchanged states are answered with 304 Not Modified. """
+        for url in (remote.URL_API_STATES,
+                    remote.URL_API_STATES_ENTITY.format("test.etag")):
+            self.hass.states.set("test.etag", "on")
+
+            req = requests.get(_url(url),
+                               params={"api_password": API_PASSWORD})
+
+            etag = req.headers['ETag']
+
+            req = requests.get(_url(url),
+                               params={"api_password": API_PASSWORD},
+                               headers={"If-None-Match": etag})
+
+            self.assertEqual(req.status_code, 304)
+
+            self.hass.states.set("test.etag", "off")
+
+            req = requests.get(_url(url),
+                               params={"api_password": API_PASSWORD},
+                               headers={"If-None-Match": etag})
+
+            self.assertEqual(req.status_code, 200)
+            self.assertNotEqual(req.headers['ETag'], etag)
+            self.assertEqual(
+                ha.State.from_dict(
+                    req.json().get("test.etag", req.json())).state, "off")
+
+    def test_api_states_compressed(self):
+        """ Test if large responses are compressed when accepted. """
+        self.hass.states.set("test.compress", "on",
+                             {"payload": "x" * http.COMPRESS_MIN_SIZE})
+
+        for accept_encoding, encoding in (
+                ("gzip", "gzip"),
+                ("deflate;q=0.5, gzip;q=0", "deflate"),
+                ("identity", None)):
+            req = requests.get(_url(remote.URL_API_STATES),
+                               params={"api_password": API_PASSWORD},
+                               headers={"Accept-Encoding": accept_encoding})
+
+            self.assertEqual(req.headers.get('Content-Encoding'), encoding)
+            self.assertEqual(req.json()["test.compress"]["state"], "on")
+
+        # Compressed and uncompressed responses share the ETag
+        etag = req.headers['ETag']
+
+        req = requests.get(_url(remote.URL_API_STATES),
+                           params={"api_password": API_PASSWORD},
+                           headers={"Accept-Encoding": "gzip"})
+
+        self.assertEqual(req.headers['ETag'], etag)
+
+        req = requests.get(_url(remote.URL_API_STATES),
+                           params={"api_password": API_PASSWORD},
+                           headers={"Accept-Encoding": "gzip",
+                                    "If-None-Match": etag})
+
+        self.assertEqual(req.status_code, 304)
+        self.assertEqual(req.headers['ETag'], etag)
+        self.assertIn(self.hass.states.run_id, etag)
+
+        # Small responses are not worth it
+        req = requests.get(
+            _url(remote.URL_API_STATES_ENTITY.format("test.etag")),
+            params={"api_password": API_PASSWORD},
+            headers={"Accept-Encoding": "gzip"})
+
+        self.assertNotIn('Content-Encoding', req.headers)
+
     def test_api_get_non_existing_state(self):
         """ Test if the debug interface allows us to get a state. """
         req = requests.get(
@@ -206,6 +1109,78 @@ class TestHTTPInterface(unittest.TestCase):
         self.assertEqual(req.status_code, 201)
         self.assertEqual(cur_state, new_state)
 
+    def test_api_set_multiple_states(self):
+        """ Test if the API sets multiple states and reports per item. """
+        req = requests.post(
+            _url(remote.URL_API_STATES),
+            data={"states": json.dumps([
+                {"entity_id": "test.bulk_1", "state": "on",
+                 "attributes": {"brightness": 100}},
+                {"entity_id": "test.bulk_2"},
+                {"entity_id": "test.bulk_3", "state": "off"},
+                "test.bulk_4",
+                {"entity_id": "", "state": "on"},
+                {"entity_id": "bad id/..", "state": "on"},
+                {"entity_id": "test.bulk_5", "state": None},
+                {"entity_id": "test.bulk_6", "state": "on",
+                 "attributes": [1]}]),
+                  "api_password": API_PASSWORD})
+
+        self.assertEqual(req.status_code, 200)
+
+        results = req.json()
+
+        self.assertEqual(len(results), 8)
+
+        for result in results[4:]:
+            self.assertIn("message", result)
+
+        for entity_id in ("", "bad id/..", "test.bulk_5", "test.bulk_6"):
+            self.assertIsNone(self.hass.states.get(entity_id))
+
+        self.assertEqual(ha.State.from_dict(results[0]),
+                         self.hass.states.get("test.bulk_1"))
+        self.assertEqual(
+            self.hass.states.get("test.bulk_1").attributes["brightness"], 100)
+        self.assertIn("message", results[1])
+        self.assertIsNone(self.hass.states.get("test.bulk_2"))
+        self.assertEqual(results[2]["state"], "off")
+        self.assertIn("message", results[3])
+
+        req = requests.post(
+            _url(remote.URL_API_STATES),
+            data={"states": "not json", "api_password": API_PASSWORD})
+
+        self.assertEqual(req.status_code, 422)
+
+    def test_api_fire_multiple_events(self):
+        """ Test if the API fires multiple events in order. """
+        fired = []
+
+        self.hass.bus.listen(
+            "test.event_bulk", lambda event: fired.append(event.data['n']))
+
+        req = requests.post(
+            _url(remote.URL_API_EVENTS),
+            data={"events": json.dumps(
+                [{"event_type": "test.event_bulk", "event_data": {"n": n}}
+                 for n in range(3)]),
+                  "api_password": API_PASSWORD})
+
+        self.assertEqual(req.status_code, 200)
+
+        # Allow the events to take place
+        time.sleep(.5)
+
+        self.assertEqual(sorted(fired), [0, 1, 2])
+
+        req = requests.post(
+            _url(remote.URL_API_EVENTS),
+            data={"events": json.dumps([{"event_data": {}}]),
+                  "api_password": API_PASSWORD})
+
+        self.assertEqual(req.status_code, 400)
+
     # pylint: disable=invalid-name
     def test_api_fire_event_with_no_data(self):
         """ Test if the API allows us to fire an event. """
@@ -249,6 +1224,34 @@ class TestHTTPInterface(unittest.TestCase):
 
         self.assertEqual(len(test_value), 1)
 
+    def test_api_fire_event_with_list_data(self):
+        """ Test if the API fires an event with data that is not an object. """
+        fired = []
+
+        self.hass.bus.listen("test.event_list",
+                             lambda event: fired.append(event.data))
+
+        req = requests.post(
+            _url(remote.URL_API_EVENTS_EVENT.format("test.event_list")),
+            data={"event_data": '[1, 2]',
+                  "api_password": API_PASSWORD})
+
+        self.assertEqual(req.status_code, 200)
+
+        req = requests.post(
+            _url(remote.URL_API_EVENTS),
+            data={"events": json.dumps(
+                [{"event_type": "test.event_list", "event_data": [3]},
+                 {"event_type": "test.event_list", "event_data": [4]}]),
+                  "api_password": API_PASSWORD})
+
+        self.assertEqual(req.status_code, 200)
+
+        # Allow the events to take place
+        time.sleep(.5)
+
+        self.assertEqual(sorted(fired), [[1, 2], [3], [4]])
+
     # pylint: disable=invalid-name
     def test_api_fire_event_with_invalid_json(self):
         """ Test if the API allows us to fire an event. """
@@ -271,6 +1274,123 @@ class TestHTTPInterface(unittest.TestCase):
         self.assertEqual(req.status_code, 422)
         self.assertEqual(len(test_value), 0)
 
+    def test_api_get_changes(self):
+        """ Test if the API returns incremental state changes. """
+        req = requests.get(_url(remote.URL_API_CHANGES),
+                           params={"api_password": API_PASSWORD})
+
+        data = req.json()
+
+        self.assertTrue(data['complete'])
+        self.assertEqual(data['sequence'], "{}-{}".format(
+            self.hass.states.run_id, self.hass.states.sequence))
+
+        self.hass.states.set("test.changes", data['sequence'])
+
+        api = remote.API("127.0.0.1", API_PASSWORD)
+
+        sequence, states, complete = remote.get_changes(api, data['sequence'])
+
+        self.assertFalse(complete)
+        self.assertEqual(sequence, "{}-{}".format(
+            self.hass.states.run_id, self.hass.states.sequence))
+        self.assertEqual(
+            states, {"test.changes": self.hass.states.get("test.changes")})
+
+        # A sequence of an earlier run gets all states
+        _, states, complete = remote.get_changes(
+            api, "0123456789abcdef-{}".format(self.hass.states.sequence - 1))
+
+        self.assertTrue(complete)
+        self.assertEqual(states, self.hass.states.all())
+
+    def test_api_get_history(self):
+        """ Test if the API returns the history of an entity. """
+        self.hass.states.set("test.history", "on")
+        self.hass.states.set("test.history", "off")
+
+        # Allow the listeners to run
+        time.sleep(.1)
+
+        req = requests.get(_url(remote.URL_API_HISTORY + "/test.history"),
+                           params={"api_password": API_PASSWORD})
+
+        self.assertEqual([state for _, state in req.json()["test.history"]],
+                         ["on", "off"])
+
+        req = requests.get(_url(remote.URL_API_HISTORY),
+                           params={"api_password": API_PASSWORD,
+                                   "entity_id": "test,test.history",
+                                   "buckets": 1})
+
+        self.assertEqual(sorted(req.json()), ["test", "test.history"])
+        self.assertEqual(len(req.json()["test.history"]), 1)
+
+        req = requests.get(_url(remote.URL_API_HISTORY),
+                           params={"api_password": API_PASSWORD,
+                                   "buckets": 10**9})
+
+        self.assertEqual(req.status_code, 400)
+
+    def test_api_stream(self):
+        """ Test if the API streams the events of the bus. """
+        _assert_streams_events(self, self.hass, remote.SERVER_PORT)
+
+    def test_streams_hold_no_worker(self):
+        """ Test that the API answers while more streams are open than the
+            pool has workers. """
+        streams = [HTTPConnection("127.0.0.1", remote.SERVER_PORT, timeout=5)
+                   for _ in range(http.POOL_MAX_THREAD + 1)]
+
+        try:
+            for conn in streams:
+                conn.request("GET", "{}?api_password={}".format(
+                    remote.URL_API_STREAM, API_PASSWORD))
+
+                self.assertEqual(conn.getresponse().status, 200)
+
+            req = requests.get(_url(remote.URL_API),
+                               params={"api_password": API_PASSWORD},
+                               timeout=5)
+
+            self.assertEqual(req.status_code, 200)
+
+        finally:
+            for conn in streams:
+                conn.close()
+
+    def test_event_stream_drops_slow_client(self):
+        """ Test that a client that falls behind is dropped. """
+        client = http.EventStreamClient(max_size=2)
+
+        self.assertTrue(client.put(b"1"))
+        self.assertTrue(client.put(b"2"))
+        self.assertFalse(client.put(b"3"))
+
+        self.assertTrue(client.dropped)
+        self.assertEqual(client.get(), [b"1", b"2"])
+
+    def test_api_get_stats(self):
+        """ Test if the API returns the metrics of the pool and scheduler. """
+        def stats_action(now):
+            """ Does nothing. """
+
+        self.hass.track_point_in_time(stats_action, dt.datetime.now())
+        self.hass.bus.fire(ha.EVENT_TIME_CHANGED,
+                           {ha.ATTR_NOW: dt.datetime.now()})
+
+        # Allow the job to run
+        time.sleep(.1)
+
+        req = requests.get(_url(remote.URL_API_STATS),
+                           params={"api_password": API_PASSWORD})
+
+        data = req.json()
+
+        self.assertGreater(data['pool']['jobs_done'], 0)
+        self.assertEqual(data['scheduler_lateness']['stats_action']['count'],
+                         1)
+
     def test_api_get_event_listeners(self):
         """ Test if we can get the list of events being listened for. """
         req = requests.get(_url(remote.URL_API_EVENTS),
@@ -366,6 +1486,145 @@ class TestRemoteMethods(unittest.TestCase):
 
         self.assertEqual(len(test_value), 1)
 
+    def test_event_forwarder(self):
+        """ Test that the event forwarder sends events in batches. """
+        forwarded = []
+
+        self.hass.bus.listen(
+            "test.forwarded", lambda event: forwarded.append(event.data['n']))
+
+        hass = ha.HomeAssistant()
+
+        forwarder = remote.EventForwarder(hass)
+        forwarder.connect(self.api)
+
+        for number in range(250):
+            hass.bus.fire("test.forwarded", {'n': number})
+
+        # Allow the listeners to queue the events
+        time.sleep(.5)
+
+        forwarder.block_till_done()
+
+        # Allow the events to take place
+        time.sleep(.5)
+
+        self.assertEqual(sorted(forwarded), list(range(250)))
+        self.assertEqual(forwarder.dropped, 0)
+
+        self.assertTrue(forwarder.disconnect(self.api))
+
+    def test_forward_target_retries_and_drops(self):
+        """ Test that a forward target retries and bounds its queue. """
+        batches = []
+        failed = threading.Event()
+
+        class FailingAPI(object):  # pylint: disable=too-few-public-methods
+            """ API that fails the first request. """
+            base_url = "http://failing"
+
+            def __call__(self, method, path, data=None, timeout=None):
+                batches.append(json.loads(data['events']))
+
+                if len(batches) == 1:
+                    failed.set()
+                    raise ha.HomeAssistantError("Error connecting to server")
+
+                response = requests.Response()
+                response.status_code = 200
+
+                return response
+
+        retry_min = remote.FORWARD_RETRY_MIN
+        remote.FORWARD_RETRY_MIN = .2
+
+        try:
+            target = remote.ForwardTarget(FailingAPI(), queue_size=2)
+
+            target.put(ha.Event("test", {'n': 0}))
+
+            # Queue more events than fit while the target backs off
+            failed.wait(1)
+
+            for number in range(1, 4):
+                target.put(ha.Event("test", {'n': number}))
+
+            target.block_till_done()
+
+        finally:
+            remote.FORWARD_RETRY_MIN = retry_min
+
+        # First event was sent and retried, the queue kept the 2 newest
+        self.assertEqual(len(batches), 3)
+        self.assertEqual(batches[0], batches[1])
+        self.assertEqual([event['event_data']['n'] for event in batches[2]],
+                         [2, 3])
+        self.assertEqual(target.dropped, 1)
+
+        target.stop()
+
+    def test_forward_target_drops_rejected_batch(self):
+        """ Test that a batch the target rejects is not retried. """
+        paths = []
+
+        class RejectingAPI(object):  # pylint: disable=too-few-public-methods
+            """ API that rejects every request. """
+            base_url = "http://rejecting"
+
+            def __call__(self, method, path, data=None, timeout=None):
+                paths.append(path)
+
+                response = requests.Response()
+                response.status_code = 401
+
+                return response
+
+        target = remote.ForwardTarget(RejectingAPI())
+
+        target.put(ha.Event("test_1"))
+
+        target.block_till_done()
+
+        self.assertEqual(paths, [remote.URL_API_EVENTS])
+        self.assertEqual(target.dropped, 1)
+
+        target.stop()
+
+    def test_forward_target_without_bulk_events(self):
+        """ Test that events are forwarded one at a time to targets that
+            do not support firing multiple events. """
+        paths = []
+
+        class OldAPI(object):  # pylint: disable=too-few-public-methods
+            """ API of a version without POST /api/events. """
+            base_url = "http://old"
+
+            def __call__(self, method, path, data=None, timeout=None):
+                paths.append(path)
+
+                response = requests.Response()
+                response.status_code = \
+                    405 if path == remote.URL_API_EVENTS else 200
+
+                return response
+
+        target = remote.ForwardTarget(OldAPI())
+
+        target.put(ha.Event("test_1"))
+        target.put(ha.Event("test_2"))
+
+        target.block_till_done()
+
+        self.assertEqual(paths[0], remote.URL_API_EVENTS)
+        self.assertEqual(
+            [path for path in paths if path != remote.URL_API_EVENTS],
+            [remote.URL_API_EVENTS_EVENT.format("test_1"),
+             remote.URL_API_EVENTS_EVENT.format("test_2")])
+        self.assertFalse(target.bulk)
+        self.assertEqual(target.dropped, 0)
+
+        target.stop()
+
     def test_get_state(self):
         """ Test Python API get_state. """
 
@@ -384,6 +1643,75 @@ class TestRemoteMethods(unittest.TestCase):
 
         self.assertEqual(self.hass.states.get('test').state, 'set_test')
 
+    def test_set_states(self):
+        """ Test Python API set_states. """
+        states = remote.set_states(
+            self.api, [('test.remote_1', 'on', {'brightness': 100}),
+                       ('test.remote_2', 'off', None)])
+
+        self.assertEqual(states, [self.hass.states.get('test.remote_1'),
+                                  self.hass.states.get('test.remote_2')])
+        self.assertEqual(states[0].attributes, {'brightness': 100})
+
+    def test_set_states_without_bulk_states(self):
+        """ Test that states are set one at a time on APIs that do not
+            support setting multiple states. """
+        paths = []
+
+        class OldAPI(object):  # pylint: disable=too-few-public-methods
+            """ API of a version without POST /api/states. """
+            base_url = "http://old"
+
+            def __call__(self, method, path, data=None, timeout=None):
+                paths.append(path)
+
+                response = requests.Response()
+                response.status_code = \
+                    405 if path == remote.URL_API_STATES else 201
+
+                return response
+
+        self.assertIsNone(remote.set_states(
+            OldAPI(), (state for state in [('test.old_1', 'on', None),
+                                           ('test.old_2', 'off', None)])))
+
+        self.assertEqual(
+            paths, [remote.URL_API_STATES,
+                    remote.URL_API_STATES_ENTITY.format('test.old_1'),
+                    remote.URL_API_STATES_ENTITY.format('test.old_2')])
+
+    def test_statemachine_mirror(self):
+        """ Test that the mirror versions and logs the changes it applies. """
+        self.hass.states.set('test.mirror', 'on')
+
+        mirror = remote.StateMachine(ha.EventBus(), self.api)
+
+        sequence = mirror.sequence
+        version = mirror.get_version('test.mirror')
+
+        self.hass.states.set('test.mirror', 'off')
+        mirror.mirror()
+
+        self.assertEqual(mirror.get_version('test.mirror'), version + 1)
+        self.assertEqual(mirror.changes_since(sequence),
+                         (sequence + 1,
+                          {'test.mirror': mirror.get('test.mirror')}))
+
+        # Overflow the change log so the next mirror gets a full snapshot
+        self.hass.states.remove('test.mirror')
+
+        for number in range(ha.CHANGE_LOG_SIZE + 1):
+            self.hass.states.set('test.mirror_overflow', str(number))
+
+        sequence = mirror.sequence
+        mirror.mirror()
+
+        self.assertIsNone(mirror.get('test.mirror'))
+        self.assertEqual(mirror.get_version('test.mirror'), version + 2)
+        self.assertIsNone(mirror.changes_since(sequence)[1]['test.mirror'])
+
+        self.hass.states.remove('test.mirror_overflow')
+
     def test_is_state(self):
         """ Test Python API is_state. """
 
@@ -5,7 +5,11 @@ homeassistant.util
 Helper methods for various modules.
 """
 import threading
-import queue
+import collections
+import collections.abc
+import itertools
+import bisect
+import time
 import datetime
 import re
 import enum
@@ -56,7 +60,7 @@ def split_entity_id(entity_id):
 
 def repr_helper(inp):
     """ Helps creating a more readable string representation of objects. """
-    if isinstance(inp, dict):
+    if isinstance(inp, collections.abc.Mapping):
         return ", ".join(
             repr_helper(key)+"="+repr_helper(item) for key, item
             in inp.items())
@@ -143,6 +147,20 @@ def get_local_ip():
         return socket.gethostbyname(socket.gethostname())
 
 
+class Sampler(object):
+    """ Callable that returns True once every `every` calls.
+    Always returns False if every is 0. """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, every):
+        self.every = every
+        self._calls = itertools.count(1)
+
+    def __call__(self):
+        # next() on itertools.count is atomic, no lock needed
+        return bool(self.every) and next(self._calls) % self.every == 0
+
+
 class OrderedEnum(enum.Enum):
     """ Taken from Python 3.4.0 docs. """
     # pylint: disable=no-init
@@ -180,70 +198,254 @@ class OrderedEnum(enum.Enum):
 #    put that request in a seperate thread. This is for every component to
 #    decide on its own instead of enforcing it for everyone.
 class ThreadPool(object):
-    """ A simple queue-based thread pool.
+    """ A priority queue based thread pool that grows and shrinks.
 
-    Will initiate it's workers using worker(queue).start() """
+    Jobs are kept in a FIFO queue per priority, so jobs with the same
+    priority are started in the order they were added.
 
-    # pylint: disable=too-few-public-methods
-    def __init__(self, worker_count, job_handler, busy_callback=None):
+    General workers handle jobs of any priority. Their number grows up to
+    max_worker_count when more jobs are waiting than workers are idle or
+    when a job waited longer than max_job_age, and shrinks back to
+    worker_count when workers are idle for idle_timeout seconds.
+
+    Reserved workers form lanes that only handle jobs with a priority equal
+    to or more important than their lane. This prevents important jobs from
+    getting stuck behind slow unimportant jobs. """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self, worker_count, job_handler, busy_callback=None,
+                 max_worker_count=None, reserved_workers=None,
+                 idle_timeout=60, max_job_age=1):
         """
-        worker_count: number of threads to run that handle jobs
+        worker_count: minimum number of threads to run that handle jobs
         job_handler: method to be called from worker thread to handle job
         busy_callback: method to be called when queue gets too big.
                        Parameters: list_of_current_jobs, number_pending_jobs
+        max_worker_count: maximum number of general threads, defaults to
+                          worker_count
+        reserved_workers: dict mapping a priority to the number of threads
+                          that only handle jobs of at least that priority
+        idle_timeout: seconds a worker above worker_count may be idle
+        max_job_age: seconds a job may wait before a worker is added
         """
-        work_queue = self.work_queue = queue.PriorityQueue()
-        current_jobs = self.current_jobs = []
+        self.current_jobs = []
         self.busy_callback = busy_callback
         self.busy_warning_limit = worker_count**2
-
-        for _ in range(worker_count):
-            worker = threading.Thread(target=_threadpool_worker,
-                                      args=(work_queue, current_jobs,
-                                            job_handler))
-            worker.daemon = True
-            worker.start()
-
-    def add_job(self, priority, job):
-        """ Add a job to be sent to the workers. """
-        self.work_queue.put(PriorityQueueItem(priority, job))
+        self.min_worker_count = worker_count
+        self.max_worker_count = max(max_worker_count or 0, worker_count)
+        self.worker_count = 0
+        self.idle_timeout = idle_timeout
+        self.max_job_age = max_job_age
+
+        self._job_handler = job_handler
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._lane_conditions = {}
+        self._idle_count = 0
+
+        # Maps priority to a deque of (time added, job, key) tuples
+        self._queues = {}
+        # Known priorities, most important first
+        self._priorities = []
+        self._pending_count = 0
+
+        # Maps keys of queued or running jobs to a deque of
+        # (priority, job) tuples that wait for them to finish
+        self._keyed_jobs = {}
+
+        # Metrics
+        self._jobs_done = 0
+        self._total_wait = 0
+        self._max_wait = 0
+        self._total_run = 0
+
+        with self._lock:
+            for _ in range(worker_count):
+                self._start_worker()
+
+            for priority, count in (reserved_workers or {}).items():
+                self._lane_conditions[priority] = \
+                    threading.Condition(self._lock)
+
+                for _ in range(count):
+                    self._start_worker(priority)
+
+        if self.max_worker_count > self.min_worker_count:
+            monitor = threading.Thread(target=self._monitor)
+            monitor.daemon = True
+            monitor.start()
+
+    @property
+    def stats(self):
+        """ Dict with metrics about the pool. Times are in seconds. """
+        with self._lock:
+            done = self._jobs_done or 1
+
+            return {'workers': self.worker_count,
+                    'idle_workers': self._idle_count,
+                    'queue_depth': self._pending_count,
+                    'running_jobs': len(self.current_jobs),
+                    'jobs_done': self._jobs_done,
+                    'average_wait_time': self._total_wait / done,
+                    'max_wait_time': self._max_wait,
+                    'average_run_time': self._total_run / done}
+
+    def add_job(self, priority, job, key=None):
+        """ Add a job to be sent to the workers.
+
+        Jobs that share a key are run one after the other in the order they
+        were added. Jobs with different keys still run in parallel. """
+        with self._lock:
+            if key is not None:
+                if key in self._keyed_jobs:
+                    # A job with this key is queued or running. This job will
+                    # be queued as soon as all earlier ones are done.
+                    self._keyed_jobs[key].append((priority, job))
+                    return
+
+                self._keyed_jobs[key] = collections.deque()
+
+            self._queue_job(priority, job, key)
+
+    def _queue_job(self, priority, job, key):
+        """ Queues a job for the workers. Expects the lock to be held. """
+        queue = self._queues.get(priority)
+
+        if queue is None:
+            queue = self._queues[priority] = collections.deque()
+            bisect.insort(self._priorities, priority)
+
+        queue.append((time.monotonic(), job, key))
+        self._pending_count += 1
+
+        self._condition.notify()
+
+        for lane, condition in self._lane_conditions.items():
+            if priority <= lane:
+                condition.notify()
+
+        pending = self._pending_count
+
+        self._grow_if_needed()
 
         # check if our queue is getting too big
-        if self.work_queue.qsize() > self.busy_warning_limit:
+        if pending > self.busy_warning_limit and self.busy_callback:
 
             # Increase limit we will issue next warning
             self.busy_warning_limit *= 2
 
-            self.busy_callback(self.current_jobs, self.work_queue.qsize())
+            self.busy_callback(list(self.current_jobs), pending)
 
+    def _start_worker(self, lane=None):
+        """ Starts a worker thread. Expects the lock to be held. """
+        if lane is None:
+            self.worker_count += 1
 
-class PriorityQueueItem(object):
-    """ Holds a priority and a value. Used within PriorityQueue. """
+        worker = threading.Thread(target=self._worker, args=(lane,))
+        worker.daemon = True
+        worker.start()
 
-    # pylint: disable=too-few-public-methods
-    def __init__(self, priority, item):
-        self.priority = priority
-        self.item = item
+    def _grow_if_needed(self):
+        """ Starts a general worker if more jobs are waiting than workers
+        are idle or if the next job has been waiting for too long. Expects
+        the lock to be held. """
+        if not self._pending_count or \
+           self.worker_count >= self.max_worker_count:
+            return
 
-    def __lt__(self, other):
-        return self.priority < other.priority
+        if self._pending_count > self._idle_count or \
+           time.monotonic() - self._peek_job()[0] > self.max_job_age:
+            self._start_worker()
+
+    def _monitor(self):
+        """ Checks the waiting jobs every max_job_age seconds. Without new
+        jobs coming in nothing else would notice that a job got stuck, for
+        example behind a notified worker that has not woken up yet. """
+        while True:
+            time.sleep(self.max_job_age)
+
+            with self._lock:
+                self._grow_if_needed()
+
+    def _peek_job(self):
+        """ Returns the (time added, job, key) tuple that is next in line.
+        Expects the lock to be held and a job to be pending. """
+        for priority in self._priorities:
+            queue = self._queues[priority]
+
+            if queue:
+                return queue[0]
+
+    def _get_job(self, lane):
+        """ Pops the next (time added, job, key) tuple that the worker of lane
+        may handle or returns None. Expects the lock to be held. """
+        for priority in self._priorities:
+            if lane is not None and priority > lane:
+                break
+
+            queue = self._queues[priority]
+
+            if queue:
+                self._pending_count -= 1
+
+                return queue.popleft()
+
+        return None
+
+    def _worker(self, lane):
+        """ Provides the base functionality of a worker for the pool. """
+        if lane is None:
+            condition, timeout = self._condition, self.idle_timeout
+        else:
+            condition, timeout = self._lane_conditions[lane], None
+
+        while True:
+            with self._lock:
+                item = self._get_job(lane)
+
+                while item is None:
+                    if lane is None:
+                        self._idle_count += 1
+
+                    notified = condition.wait(timeout)
+
+                    if lane is None:
+                        self._idle_count -= 1
+
+                    item = self._get_job(lane)
+
+                    # Stop this worker if it was idle for too long
+                    if item is None and not notified and lane is None and \
+                       self.worker_count > self.min_worker_count:
+                        self.worker_count -= 1
+                        return
+
+                added, job, key = item
+
+                start = time.monotonic()
+                wait = start - added
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
 
+                # Add to current running jobs
+                job_log = (datetime.datetime.now(), job)
+                self.current_jobs.append(job_log)
 
-def _threadpool_worker(work_queue, current_jobs, job_handler):
-    """ Provides the base functionality of a worker for the thread pool. """
-    while True:
-        # Get new item from work_queue
-        job = work_queue.get().item
+            # Do the job
+            self._job_handler(job)
 
-        # Add to current running jobs
-        job_log = (datetime.datetime.now(), job)
-        current_jobs.append(job_log)
+            with self._lock:
+                # Remove from current running job
+                self.current_jobs.remove(job_log)
 
-        # Do the job
-        job_handler(job)
+                self._jobs_done += 1
+                self._total_run += time.monotonic() - start
 
-        # Remove from current running job
-        current_jobs.remove(job_log)
+                # Queue the next job waiting for this key
+                if key is not None:
+                    waiting = self._keyed_jobs[key]
 
-        # Tell work_queue a task is done
-        work_queue.task_done()
+                    if waiting:
+                        self._queue_job(*waiting.popleft(), key=key)
+                    else:
+                        del self._keyed_jobs[key]